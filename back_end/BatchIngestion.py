@@ -0,0 +1,294 @@
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from PDF_Processor import (SUMMARY_KEYWORD_SYSTEM_PROMPT, _parse_summary_keyword, summarize_and_extract_keyword,
+                           extraction_settings)
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_WORK_DIR = 'batch_jobs'
+
+# Trạng thái cuối cùng của một batch, không cần poll thêm
+BATCH_DONE_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def build_batch_request(custom_id, paragraph):
+    """
+    Một dòng của file batch: request tóm tắt và tách từ khóa giống summarize_and_extract_keyword.
+    """
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': 'gpt-4o-mini',
+            'temperature': 0,
+            'response_format': {'type': 'json_object'},
+            'messages': [
+                {'role': 'system', 'content': SUMMARY_KEYWORD_SYSTEM_PROMPT},
+                {'role': 'user', 'content': paragraph},
+            ],
+        },
+    }
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def read_jsonl(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+class BatchBackend(ABC):
+    """
+    Giao diện của nơi xử lý file batch. Một backend cần:
+    - submit(input_path): gửi file JSONL các request, trả về batch_id.
+    - status(batch_id): trạng thái hiện tại ('completed', 'failed', 'in_progress', ...).
+    - download_results(batch_id, output_path): ghi kết quả (JSONL, mỗi dòng có custom_id) vào output_path.
+    """
+
+    @abstractmethod
+    def submit(self, input_path):
+        pass
+
+    @abstractmethod
+    def status(self, batch_id):
+        pass
+
+    @abstractmethod
+    def download_results(self, batch_id, output_path):
+        pass
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Gửi file batch qua OpenAI Batch API (rẻ hơn gọi trực tiếp, kết quả có trong vòng 24 giờ).
+    """
+
+    def __init__(self, client, completion_window='24h'):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path):
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def download_results(self, batch_id, output_path):
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            # Request lỗi nằm trong error_file, các request này sẽ được gọi lại riêng lẻ
+            if batch.output_file_id:
+                f.write(self.client.files.content(batch.output_file_id).text)
+
+class LocalFileBatchBackend(BatchBackend):
+    """
+    Backend thay thế chạy hoàn toàn trên máy: batch được xử lý khi được poll lần đầu bằng hàm respond,
+    kết quả được ghi theo đúng định dạng file output của OpenAI Batch API.
+    Dùng để chạy thử toàn bộ luồng batch mà không cần mạng.
+    """
+
+    def __init__(self, respond, work_dir=BATCH_WORK_DIR):
+        """
+        Args:
+            respond (callable): Hàm nhận body của một request, trả về nội dung trả lời (str).
+            work_dir (str): Thư mục lưu file input/output của các batch.
+        """
+        self.respond = respond
+        self.work_dir = work_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+    @classmethod
+    def from_client(cls, client, work_dir=BATCH_WORK_DIR):
+        """Xử lý từng request bằng client (ví dụ CachedChatClient) thay vì Batch API."""
+        return cls(lambda body: client.chat.completions.create(**body).choices[0].message.content, work_dir)
+
+    def _batch_path(self, batch_id, name):
+        return os.path.join(self.work_dir, f"{batch_id}_{name}.jsonl")
+
+    def submit(self, input_path):
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        write_jsonl(self._batch_path(batch_id, 'input'), read_jsonl(input_path))
+        return batch_id
+
+    def status(self, batch_id):
+        output_path = self._batch_path(batch_id, 'output')
+        if os.path.exists(output_path):
+            return 'completed'
+        if not os.path.exists(self._batch_path(batch_id, 'input')):
+            return 'failed'
+
+        results = []
+        for request in read_jsonl(self._batch_path(batch_id, 'input')):
+            try:
+                content = self.respond(request['body'])
+                results.append({
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 200,
+                                 'body': {'choices': [{'index': 0, 'message': {'role': 'assistant',
+                                                                               'content': content}}]}},
+                    'error': None,
+                })
+            except Exception as e:
+                results.append({'custom_id': request['custom_id'], 'response': None,
+                                'error': {'message': str(e)}})
+        write_jsonl(f"{output_path}.tmp", results)
+        os.replace(f"{output_path}.tmp", output_path)
+        return 'completed'
+
+    def download_results(self, batch_id, output_path):
+        write_jsonl(output_path, read_jsonl(self._batch_path(batch_id, 'output')))
+
+def _parse_batch_output(record):
+    """
+    Returns:
+        tuple (summary, keyword) của một dòng kết quả, hoặc None nếu request lỗi hoặc JSON không hợp lệ.
+    """
+    response = record.get('response') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        return None
+    try:
+        content = response['body']['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return None
+    return _parse_summary_keyword(content)
+
+def run_batch_extraction(backend, texts, checkpoint=None, client=None, work_dir=BATCH_WORK_DIR, poll_interval=60,
+                         timeout=None):
+    """
+    Tóm tắt và tách từ khóa cho các đoạn văn qua một batch:
+    ghi tất cả request vào file JSONL, gửi cho backend, poll đến khi batch xong rồi đọc kết quả.
+    batch_id được lưu trong work_dir theo nội dung các đoạn văn, nên nếu tiến trình dừng giữa chừng
+    thì lần chạy lại sẽ tiếp tục poll batch cũ thay vì gửi lại.
+
+    Args:
+        backend (BatchBackend): Nơi xử lý batch.
+        texts (list): Danh sách đoạn văn.
+        checkpoint (IngestionCheckpoint): Kết quả được lưu ở bước 'summary_keyword', các đoạn đã có kết quả không được gửi lại.
+        client: OpenAI client để gọi lại riêng lẻ các đoạn bị lỗi trong batch, None = báo lỗi.
+        poll_interval (float): Số giây giữa hai lần kiểm tra trạng thái.
+        timeout (float): Thời gian chờ tối đa (giây), None = chờ đến khi xong.
+
+    Returns:
+        list: Các tuple (summary, keyword) theo thứ tự texts.
+    """
+    results = checkpoint.load_results('summary_keyword', texts) if checkpoint is not None else {}
+    pending_positions = [position for position in range(len(texts)) if position not in results]
+
+    if pending_positions:
+        os.makedirs(work_dir, exist_ok=True)
+        job_hash = hashlib.sha256(json.dumps([texts[position] for position in pending_positions],
+                                             ensure_ascii=False).encode('utf-8')).hexdigest()
+        state_path = os.path.join(work_dir, f"{job_hash}.json")
+        input_path = os.path.join(work_dir, f"{job_hash}_input.jsonl")
+        output_path = os.path.join(work_dir, f"{job_hash}_output.jsonl")
+
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                batch_id = json.load(f)['batch_id']
+            print(f"♻️  Tiếp tục chờ batch đã gửi: {batch_id}")
+        else:
+            write_jsonl(input_path, [build_batch_request(f"paragraph-{position}", texts[position])
+                                     for position in pending_positions])
+            batch_id = backend.submit(input_path)
+            with open(state_path, 'w', encoding='utf-8') as f:
+                json.dump({'batch_id': batch_id, 'n_requests': len(pending_positions)}, f)
+            print(f"📤 Đã gửi batch {batch_id} gồm {len(pending_positions)} request")
+
+        start_time = time.time()
+        status = backend.status(batch_id)
+        while status not in BATCH_DONE_STATUSES:
+            if timeout is not None and time.time() - start_time > timeout:
+                raise TimeoutError(f"Batch {batch_id} chưa xong sau {timeout}s (trạng thái: {status})")
+            print(f"⏳ Batch {batch_id}: {status}")
+            time.sleep(poll_interval)
+            status = backend.status(batch_id)
+        print(f"📥 Batch {batch_id} kết thúc với trạng thái: {status}")
+
+        batch_results = {}
+        if status == 'completed':
+            backend.download_results(batch_id, output_path)
+            for record in read_jsonl(output_path):
+                position = int(record['custom_id'].split('-', 1)[1])
+                batch_results[position] = _parse_batch_output(record)
+
+        # Lưu các kết quả hợp lệ và xóa trạng thái batch trước, lần chạy lại chỉ gửi lại các đoạn còn thiếu
+        for position in pending_positions:
+            if batch_results.get(position) is not None:
+                results[position] = batch_results[position]
+                if checkpoint is not None:
+                    checkpoint.save_result('summary_keyword', position, texts[position], results[position])
+        for path in (state_path, input_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        failed_positions = [position for position in pending_positions if position not in results]
+        if failed_positions:
+            if client is None:
+                raise RuntimeError(f"Batch {batch_id} có {len(failed_positions)} đoạn văn không có kết quả hợp lệ")
+            print(f"⚠️  Gọi lại riêng lẻ {len(failed_positions)} đoạn văn lỗi trong batch")
+            for position in failed_positions:
+                results[position] = summarize_and_extract_keyword(client, texts[position])
+                if checkpoint is not None:
+                    checkpoint.save_result('summary_keyword', position, texts[position], results[position])
+
+    return [tuple(results[position]) for position in range(len(texts))]
+
+
+if __name__ == "__main__":
+    # Nhập hàng loạt các file PDF bằng chế độ batch, mỗi file tạo ra một ontology:
+    # python BatchIngestion.py <thư mục PDF> <thư mục ontology> [--local]
+    # --local: xử lý batch ngay trên máy bằng client thường thay cho OpenAI Batch API
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    from sentence_transformers import SentenceTransformer
+    from doclayout_yolo import YOLOv10
+    import easyocr
+    from MainProcessor import process_PDF_file, create_ontology
+    from IngestionCheckpoint import IngestionCheckpoint
+    from ParagraphClusterer import EmbeddingStore
+
+    if len(sys.argv) < 3:
+        print("Cách dùng: python BatchIngestion.py <thư mục PDF> <thư mục ontology> [--local]")
+        sys.exit(1)
+    pdf_dir, output_dir = sys.argv[1], sys.argv[2]
+    os.makedirs(output_dir, exist_ok=True)
+
+    load_dotenv(dotenv_path="secrect.env")
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    backend = LocalFileBatchBackend.from_client(client) if '--local' in sys.argv else OpenAIBatchBackend(client)
+    layout_model_path = "model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt"
+    model_detect_layout = YOLOv10(layout_model_path)
+    reader = easyocr.Reader(['vi', 'en'], gpu=False)
+    model_embedding = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+
+    for filename in sorted(os.listdir(pdf_dir)):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        pdf_path = os.path.join(pdf_dir, filename)
+        name = os.path.splitext(filename)[0]
+        checkpoint = IngestionCheckpoint.for_pdf('ingestion_jobs', pdf_path, settings=extraction_settings(),
+                                                 model_path=layout_model_path)
+        embedding_store = EmbeddingStore(model_embedding)
+        try:
+            clustering_tree = process_PDF_file(client, model_embedding, model_detect_layout, reader, pdf_path,
+                                               checkpoint=checkpoint, extraction_mode='batch', batch_backend=backend,
+                                               embedding_store=embedding_store)
+        except Exception:
+            checkpoint.release()
+            raise
+        create_ontology(model_embedding, clustering_tree, os.path.join(output_dir, f"{name}.owl"),
+                        f"http://www.semanticweb.org/{name}_MINDMAP", embedding_store)
+        checkpoint.clear()
+        print(f"✅ Đã tạo ontology cho {filename}")
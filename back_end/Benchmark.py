@@ -0,0 +1,321 @@
+import sys
+import time
+import fitz
+import numpy as np
+from sklearn.preprocessing import normalize
+from PDF_Processor import render_page_image, detect_layout_batch, LAYOUT_DPI, summarize_and_extract_keyword
+from LocalSummarizer import LocalSummarizer
+from EmbeddingBackend import create_embedding_backend
+from ParagraphClusterer import ParagraphClusterer, EmbeddingStore
+from FindOptimalK import get_safe_k_range, linkage_wcss_curve, auto_select_optimal_k
+from RunBuildTree import run_clustering_with_tree_building
+
+def benchmark_layout_batch_sizes(model_detect_layout, pdf_path, batch_sizes=(1, 4, 8, 16), max_pages=16,
+                                 dpi=LAYOUT_DPI):
+    """
+    Đo tốc độ phát hiện bố cục (trang/giây) trên CPU với các batch size khác nhau.
+    Các trang được render trước một lần để chỉ đo thời gian predict.
+
+    Args:
+        model_detect_layout: Model Doclayout-yolo
+        pdf_path (str): Đường dẫn file PDF dùng để đo.
+        batch_sizes (tuple): Các batch size cần so sánh.
+        max_pages (int): Số trang tối đa được dùng.
+        dpi (int): Độ phân giải khi render.
+
+    Returns:
+        dict: {batch_size: số trang/giây}
+    """
+    with fitz.open(pdf_path) as documents:
+        n_pages = min(max_pages, documents.page_count)
+        images = [render_page_image(documents[i], i, dpi=dpi)["image"] for i in range(n_pages)]
+
+    # Chạy một lần để khởi động model, tránh tính thời gian nạp trọng số vào lần đo đầu tiên
+    detect_layout_batch(model_detect_layout, images[:1], batch_size=1)
+
+    results = {}
+    for batch_size in batch_sizes:
+        start_time = time.time()
+        detect_layout_batch(model_detect_layout, images, batch_size=batch_size)
+        elapsed = time.time() - start_time
+        results[batch_size] = n_pages / elapsed if elapsed > 0 else float('inf')
+
+    print(f"--- Tốc độ phát hiện bố cục trên {n_pages} trang (CPU) ---")
+    for batch_size, pages_per_second in results.items():
+        print(f"Batch size {batch_size:>3}: {pages_per_second:.2f} trang/giây")
+    return results
+
+
+def compare_local_and_llm_extraction(client, model_embedding, paragraphs, max_paragraphs=20):
+    """
+    So sánh tóm tắt/từ khóa của LocalSummarizer với LLM (summarize_and_extract_keyword) trên cùng các đoạn văn.
+    Chất lượng được ước lượng bằng độ tương đồng cosine giữa bản tóm tắt và đoạn văn gốc (độ bao phủ nội dung),
+    tỉ lệ nén và độ tương đồng giữa từ khóa của hai cách.
+
+    Args:
+        paragraphs (list): Các đoạn văn (str).
+        max_paragraphs (int): Số đoạn văn tối đa được dùng.
+
+    Returns:
+        dict: {'local': {...}, 'llm': {...}, 'keyword_similarity': float}
+    """
+    paragraphs = paragraphs[:max_paragraphs]
+    local_summarizer = LocalSummarizer(model_embedding)
+
+    start_time = time.time()
+    local_results = local_summarizer.summarize_and_extract_keywords(paragraphs)
+    local_time = time.time() - start_time
+
+    start_time = time.time()
+    llm_results = [summarize_and_extract_keyword(client, paragraph) for paragraph in paragraphs]
+    llm_time = time.time() - start_time
+
+    paragraph_embeddings = normalize(model_embedding.encode(paragraphs), axis=1)
+
+    def evaluate(results, elapsed):
+        summaries = [summary for summary, _ in results]
+        summary_embeddings = normalize(model_embedding.encode(summaries), axis=1)
+        return {
+            'seconds_per_paragraph': elapsed / len(paragraphs),
+            'summary_similarity': float(np.mean(np.sum(summary_embeddings * paragraph_embeddings, axis=1))),
+            'compression_ratio': float(np.mean([len(summary) / max(1, len(paragraph))
+                                                for summary, paragraph in zip(summaries, paragraphs)])),
+        }
+
+    local_keywords = normalize(model_embedding.encode([keyword for _, keyword in local_results]), axis=1)
+    llm_keywords = normalize(model_embedding.encode([keyword for _, keyword in llm_results]), axis=1)
+    results = {
+        'local': evaluate(local_results, local_time),
+        'llm': evaluate(llm_results, llm_time),
+        'keyword_similarity': float(np.mean(np.sum(local_keywords * llm_keywords, axis=1))),
+    }
+
+    print(f"--- So sánh tóm tắt local và LLM trên {len(paragraphs)} đoạn văn ---")
+    for name in ('local', 'llm'):
+        metrics = results[name]
+        print(f"{name:>5}: {metrics['seconds_per_paragraph']:.3f} giây/đoạn | "
+              f"tương đồng với đoạn gốc {metrics['summary_similarity']:.3f} | "
+              f"tỉ lệ nén {metrics['compression_ratio']:.2f}")
+    print(f"Tương đồng giữa từ khóa local và LLM: {results['keyword_similarity']:.3f}")
+    for (local_summary, local_keyword), (llm_summary, llm_keyword) in list(zip(local_results, llm_results))[:3]:
+        print(f"\n[local] {local_keyword}: {local_summary}\n[llm]   {llm_keyword}: {llm_summary}")
+    return results
+
+
+def benchmark_embedding_backends(texts, backend_names=('float32', 'int8', 'onnx', 'onnx-int8'), batch_size=32,
+                                 repeats=3):
+    """
+    Đo tốc độ (text/giây) của các backend nhúng trên CPU và độ tương đồng cosine
+    giữa embedding của từng backend với model float32 gốc trên cùng các text.
+
+    Args:
+        texts (list): Các đoạn văn dùng để đo.
+        backend_names (tuple): Các backend cần so sánh (xem create_embedding_backend).
+        repeats (int): Số lần chạy để lấy thời gian nhỏ nhất.
+
+    Returns:
+        dict: {backend: {'texts_per_second', 'mean_cosine', 'min_cosine'}}
+    """
+    results = {}
+    reference = None
+    for backend_name in backend_names:
+        try:
+            backend = create_embedding_backend(backend_name)
+        except ImportError as e:
+            print(f"Bỏ qua backend {backend_name}: {str(e)}")
+            continue
+
+        # Chạy một lần để khởi động
+        backend.encode(texts[:batch_size], batch_size=batch_size)
+        elapsed = float('inf')
+        for _ in range(repeats):
+            start_time = time.time()
+            embeddings = normalize(np.asarray(backend.encode(texts, batch_size=batch_size)), axis=1)
+            elapsed = min(elapsed, time.time() - start_time)
+
+        if reference is None:
+            reference = embeddings
+        cosines = np.sum(embeddings * reference, axis=1)
+        results[backend_name] = {
+            'texts_per_second': len(texts) / elapsed if elapsed > 0 else float('inf'),
+            'mean_cosine': float(np.mean(cosines)),
+            'min_cosine': float(np.min(cosines)),
+        }
+
+    print(f"--- Tốc độ và độ chính xác của các backend nhúng trên {len(texts)} đoạn văn (CPU) ---")
+    print(f"So sánh với backend đầu tiên: {backend_names[0]}")
+    for backend_name, metrics in results.items():
+        print(f"{backend_name:>10}: {metrics['texts_per_second']:.1f} text/giây | "
+              f"cosine trung bình {metrics['mean_cosine']:.4f} | thấp nhất {metrics['min_cosine']:.4f}")
+    return results
+
+
+def benchmark_k_selection(sample_sizes=(100, 1000, 10000), engines=('kmeans', 'ward', 'average'), dim=384,
+                          kmeans_max_samples=1000, random_state=42):
+    """
+    Đo thời gian một vòng chọn số cụm (tính WCSS cho mọi k trong get_safe_k_range rồi auto_select_optimal_k)
+    của từng engine trên dữ liệu giả lập: các cụm Gaussian đã chuẩn hóa, cùng số chiều với model embedding.
+    Sweep K-Means chạy một lần fit cho mỗi k nên bị bỏ qua khi số điểm lớn hơn kmeans_max_samples.
+    Linkage của scipy cần ma trận khoảng cách O(n²) (khoảng 400MB với 10k điểm).
+
+    Returns:
+        dict: {(n, engine): {'seconds', 'k'}}
+    """
+    rng = np.random.default_rng(random_state)
+    results = {}
+    for n_samples in sample_sizes:
+        n_blobs = max(2, int(np.sqrt(n_samples) / 2))
+        centers = rng.normal(size=(n_blobs, dim))
+        X = normalize(centers[rng.integers(n_blobs, size=n_samples)] + 0.5 * rng.normal(size=(n_samples, dim)), axis=1)
+        k_range = get_safe_k_range(n_samples, min_k=1)
+
+        for engine in engines:
+            if engine == 'kmeans' and n_samples > kmeans_max_samples:
+                print(f"Bỏ qua kmeans với {n_samples} điểm (> {kmeans_max_samples})")
+                continue
+            start_time = time.time()
+            if engine == 'kmeans':
+                clusterer = ParagraphClusterer(model_embedding=None)
+                clusterer.normalized_embeddings = X
+                inertias = clusterer.find_optimal_clusters_elbow(k_range)
+            else:
+                inertias = linkage_wcss_curve(X, k_range, method=engine)
+            optimal_k = auto_select_optimal_k(k_range, inertias, show_comparison=False)
+            results[(n_samples, engine)] = {'seconds': time.time() - start_time, 'k': optimal_k}
+
+    print(f"--- Thời gian một vòng chọn k (số chiều {dim}) ---")
+    for (n_samples, engine), metrics in results.items():
+        print(f"n={n_samples:>6} | {engine:>8}: {metrics['seconds']:.3f}s | k = {metrics['k']}")
+    return results
+
+
+def tree_quality(tree, normalized_leaf_embeddings):
+    """
+    Chất lượng của cây phân cụm so với khoảng cách cosine giữa các đoạn văn lá.
+
+    Returns:
+        dict:
+            'levels', 'nodes', 'mean_branching': hình dạng cây;
+            'cophenetic_correlation': tương quan giữa khoảng cách cosine của mỗi cặp lá và vòng của
+                                      tổ tiên chung thấp nhất (càng cao, các lá gần nghĩa càng gặp nhau sớm);
+            'mean_cohesion': cosine trung bình giữa các lá và tâm của node cha trực tiếp (vòng 1).
+    """
+    leaves = [node['index'] for node in tree if node['type'] == 'leaf_node']
+    leaf_position = {leaf: position for position, leaf in enumerate(leaves)}
+    internal_nodes = [node for node in tree if node['type'] != 'leaf_node']
+    max_round = max((node['round'] for node in tree), default=0)
+
+    # ancestors[r][i] = node tổ tiên ở vòng r của lá i (hoặc -1 - i nếu lá chưa được gom đến vòng r)
+    ancestors = np.tile(-1 - np.arange(len(leaves)), (max_round + 1, 1))
+    for node in internal_nodes:
+        positions = [leaf_position[leaf] for leaf in node.get('original_indices', []) if leaf in leaf_position]
+        ancestors[node['round'], positions] = node['index']
+
+    lca_round = np.full((len(leaves), len(leaves)), max_round + 1, dtype=float)
+    for round_number in range(max_round, 0, -1):
+        same_ancestor = ancestors[round_number][:, None] == ancestors[round_number][None, :]
+        lca_round[same_ancestor] = round_number
+    upper = np.triu_indices(len(leaves), k=1)
+    cosine_distances = 1 - normalized_leaf_embeddings @ normalized_leaf_embeddings.T
+    cophenetic_correlation = (float(np.corrcoef(lca_round[upper], cosine_distances[upper])[0, 1])
+                              if len(leaves) > 2 else 0.0)
+
+    cohesions = []
+    for node in internal_nodes:
+        if node['round'] != 1:
+            continue
+        members = normalized_leaf_embeddings[[leaf_position[leaf] for leaf in node['children']]]
+        centroid = members.mean(axis=0)
+        cohesions.append(float(np.mean(members @ (centroid / (np.linalg.norm(centroid) or 1.0)))))
+
+    return {
+        'levels': max_round,
+        'nodes': len(tree),
+        'mean_branching': float(np.mean([len(node['children']) for node in internal_nodes])) if internal_nodes else 0.0,
+        'cophenetic_correlation': cophenetic_correlation,
+        'mean_cohesion': float(np.mean(cohesions)) if cohesions else 0.0,
+    }
+
+def compare_tree_engines(model_embedding, list_node, engines=('rounds', 'linkage'), branching_factor=4):
+    """
+    So sánh thời gian và chất lượng cây (tree_quality) giữa vòng lặp phân cụm từng vòng và cây linkage.
+    Dùng extraction_mode='local' để không gọi LLM; thời gian của cả hai engine đều gồm bước tóm tắt local giống nhau.
+
+    Args:
+        list_node (list): Các đoạn văn (dict có 'full_text'), ví dụ kết quả của merge_short_paragraphs.
+
+    Returns:
+        dict: {engine: {'seconds', ...tree_quality}}
+    """
+    results = {}
+    for engine in engines:
+        # Mỗi engine dùng store riêng để thời gian nhúng được tính như nhau
+        embedding_store = EmbeddingStore(model_embedding)
+        start_time = time.time()
+        result = run_clustering_with_tree_building(None, model_embedding, list_node, extraction_mode='local',
+                                                   embedding_store=embedding_store, tree_engine=engine,
+                                                   branching_factor=branching_factor)
+        elapsed = time.time() - start_time
+        leaf_texts = [node['summarized_paragraph'] for node in result['tree'] if node['type'] == 'leaf_node']
+        leaf_embeddings = normalize(embedding_store.encode(leaf_texts, show_progress_bar=False), axis=1)
+        results[engine] = {'seconds': elapsed, **tree_quality(result['tree'], leaf_embeddings)}
+
+    print(f"--- So sánh engine dựng cây trên {len(list_node)} đoạn văn ---")
+    for engine, metrics in results.items():
+        print(f"{engine:>8}: {metrics['seconds']:.2f}s | {metrics['levels']} tầng, {metrics['nodes']} node, "
+              f"trung bình {metrics['mean_branching']:.1f} con | cophenetic {metrics['cophenetic_correlation']:.3f} | "
+              f"cohesion vòng 1 {metrics['mean_cohesion']:.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    # Cách dùng: python Benchmark.py layout <file.pdf>
+    #            python Benchmark.py summarizer <file.pdf>
+    #            python Benchmark.py embedding <file.pdf>
+    #            python Benchmark.py kselect
+    #            python Benchmark.py trees <file.pdf>
+    benchmark_name = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if benchmark_name == "layout":
+        from doclayout_yolo import YOLOv10
+
+        model_detect_layout = YOLOv10("model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt")
+        benchmark_layout_batch_sizes(model_detect_layout, sys.argv[2])
+    elif benchmark_name == "summarizer":
+        import os
+        import easyocr
+        from doclayout_yolo import YOLOv10
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        from sentence_transformers import SentenceTransformer
+        from PDF_Processor import process_full_pdf, merge_short_paragraphs
+
+        load_dotenv(dotenv_path="secrect.env")
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        model_detect_layout = YOLOv10("model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt")
+        reader = easyocr.Reader(['vi', 'en'], gpu=False)
+        model_embedding = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+        pdf_result = process_full_pdf(model_detect_layout, reader, sys.argv[2])
+        paragraphs = [paragraph['full_text'] for paragraph in merge_short_paragraphs(pdf_result['all_paragraphs'])]
+        compare_local_and_llm_extraction(client, model_embedding, paragraphs)
+    elif benchmark_name == "embedding":
+        # Dùng các block text của PDF (trang có lớp text) làm tập đoạn văn lịch sử để đo
+        with fitz.open(sys.argv[2]) as documents:
+            texts = [block[4].replace('\n', ' ').strip() for page in documents for block in page.get_text('blocks')
+                     if len(block[4].split()) >= 5]
+        benchmark_embedding_backends(texts)
+    elif benchmark_name == "kselect":
+        benchmark_k_selection()
+    elif benchmark_name == "trees":
+        import easyocr
+        from doclayout_yolo import YOLOv10
+        from sentence_transformers import SentenceTransformer
+        from PDF_Processor import process_full_pdf, merge_short_paragraphs
+
+        model_detect_layout = YOLOv10("model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt")
+        reader = easyocr.Reader(['vi', 'en'], gpu=False)
+        model_embedding = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+        pdf_result = process_full_pdf(model_detect_layout, reader, sys.argv[2])
+        compare_tree_engines(model_embedding, merge_short_paragraphs(pdf_result['all_paragraphs']))
+    else:
+        print("Cách dùng: python Benchmark.py layout|summarizer|embedding|trees <file.pdf> | python Benchmark.py kselect")
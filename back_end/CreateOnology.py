@@ -1,6 +1,10 @@
 from owlready2 import *
 import types
 import re
+import os
+import ast
+import json
+import base64
 import numpy as np
 from LLMquery import get_embedding
 
@@ -34,6 +38,126 @@ def convert_embedding_to_string(embedding_matrix: np.ndarray) -> str:
     list_of_lists = matrix_to_convert.tolist()
     return str(list_of_lists)
 
+# Định dạng gọn của annotation summary_embeddings: "emb1;<dtype>;<số chiều>;<base64 của mảng little-endian>"
+EMBEDDING_FORMAT_VERSION = "emb1"
+EMBEDDING_ANNOTATION_DTYPE = "float16"
+EMBEDDING_SIDECAR_SUFFIX = ".embeddings.npz"
+
+def encode_embedding(embedding: np.ndarray, dtype: str = EMBEDDING_ANNOTATION_DTYPE) -> str:
+    """
+    Mã hóa một vector (hoặc ma trận) embedding thành chuỗi base64 có tiền tố phiên bản,
+    nhỏ hơn nhiều lần so với convert_embedding_to_string.
+
+    Args:
+        embedding: Vector 1D hoặc ma trận 2D.
+        dtype: 'float16' (gọn nhất) hoặc 'float32' (giữ nguyên độ chính xác).
+    """
+    matrix = np.asarray(embedding)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    elif matrix.ndim != 2:
+        raise ValueError("Embedding matrix must be 1D or 2D.")
+    data = np.ascontiguousarray(matrix, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    return f"{EMBEDDING_FORMAT_VERSION};{dtype};{matrix.shape[1]};{base64.b64encode(data).decode('ascii')}"
+
+def decode_embedding(value: str, dtype=np.float32) -> np.ndarray:
+    """
+    Giải mã annotation summary_embeddings thành ma trận (số hàng, số chiều).
+    Hỗ trợ cả định dạng gọn (encode_embedding) và định dạng cũ "[[0.1, 0.2, ...]]".
+    """
+    if value.startswith(EMBEDDING_FORMAT_VERSION + ";"):
+        _, stored_dtype, dimension, data = value.split(";", 3)
+        vector = np.frombuffer(base64.b64decode(data), dtype=np.dtype(stored_dtype).newbyteorder('<'))
+        return vector.reshape(-1, int(dimension)).astype(dtype)
+    try:
+        rows = json.loads(value)
+    except json.JSONDecodeError:
+        # str() của list Python có thể chứa nan/inf, không phải JSON hợp lệ
+        rows = ast.literal_eval(value)
+    return np.asarray(rows, dtype=dtype).reshape(len(rows), -1)
+
+def _annotation_value(owl_class, name):
+    values = getattr(owl_class, name, None)
+    if not values:
+        return None
+    return values[0] if isinstance(values, list) else values
+
+def load_summary_embedding_matrix(onto, ontology_path=None, dtype=np.float32):
+    """
+    Đọc embedding của tất cả các class trong ontology thành một ma trận liên tục.
+    Nếu có file sidecar (.embeddings.npz) cạnh ontology_path thì đọc trực tiếp từ file đó.
+
+    Returns:
+        tuple: (list các class, ma trận numpy (số class, số chiều)), các hàng theo đúng thứ tự list class.
+    """
+    if ontology_path and os.path.exists(ontology_path + EMBEDDING_SIDECAR_SUFFIX):
+        sidecar = np.load(ontology_path + EMBEDDING_SIDECAR_SUFFIX)
+        # Tra class theo IRI bằng một dict dựng một lần, không tìm kiếm trong ontology cho từng hàng
+        class_by_iri = {owl_class.iri: owl_class for owl_class in onto.classes()}
+        classes = [class_by_iri.get(str(iri)) for iri in sidecar["iris"]]
+        keep = [row for row, owl_class in enumerate(classes) if owl_class is not None]
+        return [classes[row] for row in keep], np.ascontiguousarray(sidecar["embeddings"][keep], dtype=dtype)
+
+    classes = []
+    compact_chunks = {}
+    legacy_rows = {}
+    for owl_class in onto.classes():
+        value = _annotation_value(owl_class, "summary_embeddings")
+        if not value:
+            continue
+        position = len(classes)
+        classes.append(owl_class)
+        if value.startswith(EMBEDDING_FORMAT_VERSION + ";"):
+            _, stored_dtype, dimension, data = value.split(";", 3)
+            compact_chunks.setdefault((stored_dtype, int(dimension)), []).append((position, base64.b64decode(data)))
+        else:
+            legacy_rows[position] = decode_embedding(value, dtype)[0]
+
+    if not classes:
+        return [], np.zeros((0, 0), dtype=dtype)
+
+    dimension = next(iter(compact_chunks))[1] if compact_chunks else len(next(iter(legacy_rows.values())))
+    matrix = np.empty((len(classes), dimension), dtype=dtype)
+    # Các vector cùng định dạng được ghép bytes rồi giải mã bằng một lần frombuffer
+    for (stored_dtype, chunk_dimension), chunks in compact_chunks.items():
+        positions = [position for position, _ in chunks]
+        data = b"".join(chunk for _, chunk in chunks)
+        matrix[positions] = np.frombuffer(data, dtype=np.dtype(stored_dtype).newbyteorder('<')).reshape(-1, chunk_dimension)
+    for position, row in legacy_rows.items():
+        matrix[position] = row
+    return classes, matrix
+
+def save_embedding_sidecar(onto, ontology_path, dtype=np.float16):
+    """
+    Ghi embedding của tất cả các class ra file .npz cạnh file ontology (theo IRI của class),
+    để load_summary_embedding_matrix đọc được bằng một lần np.load.
+    """
+    classes, matrix = load_summary_embedding_matrix(onto)
+    sidecar_path = ontology_path + EMBEDDING_SIDECAR_SUFFIX
+    with open(sidecar_path, 'wb') as f:
+        np.savez(f, iris=np.array([owl_class.iri for owl_class in classes]), embeddings=matrix.astype(dtype))
+    return sidecar_path
+
+def encode_node_summaries(model_embedding, merged_nodes, embedding_store=None):
+    """
+    Nhúng summarized_paragraph của tất cả các node trong một lần encode.
+
+    Args:
+        embedding_store: EmbeddingStore của bước phân cụm, các summary đã được nhúng khi phân cụm không bị nhúng lại.
+
+    Returns:
+        dict: {summary: vector embedding}
+    """
+    summaries = list(dict.fromkeys(node["summarized_paragraph"] for node in merged_nodes
+                                   if node.get("summarized_paragraph")))
+    if not summaries:
+        return {}
+    if embedding_store is not None:
+        embeddings = embedding_store.encode(summaries, show_progress_bar=False)
+    else:
+        embeddings = model_embedding.encode(summaries, show_progress_bar=False)
+    return dict(zip(summaries, embeddings))
+
 def safe_add_annotation_property(onto, annotation_name):
     """Tạo annotation property nếu chưa tồn tại."""
     with onto:
@@ -90,7 +214,8 @@ def group_nodes_by_parent(merged_nodes):
 
     return nodes_by_parent
 
-def process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, parent_index):
+def process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, parent_index,
+                                 summary_embeddings=None):
     """
     Xử lý các node theo từng cấp độ, bắt đầu từ một parent_index cụ thể.
 
@@ -100,6 +225,7 @@ def process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_n
         class_names: Dictionary lưu trữ class_name theo index.
         parent_index: Index của parent đang được xử lý.
         merged_nodes: Danh sách các node đã được xử lý (để lấy thông tin summary).
+        summary_embeddings: Dictionary {summary: embedding} đã nhúng sẵn (từ encode_node_summaries).
     """
     current_level_nodes = nodes_by_parent.get(parent_index, [])
     for node in current_level_nodes:
@@ -120,13 +246,16 @@ def process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_n
             parent_class_name = "Thing" # Fallback
 
         class_name_list = [class_name]
-        add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_list, node, merged_nodes)
+        add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_list, node, merged_nodes,
+                              summary_embeddings)
         class_names[index] = class_name_list[0] # Cập nhật tên class nếu có thay đổi
 
         # Đệ quy xử lý các node con
-        process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, index)
+        process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, index,
+                                     summary_embeddings)
 
-def add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_list, node, merged_nodes):
+def add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_list, node, merged_nodes,
+                          summary_embeddings=None):
     """
     Thêm một class vào ontology, kiểm tra trùng lặp và tạo quan hệ cha-con.
     Thêm annotation 'summary' cho class.
@@ -137,6 +266,7 @@ def add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_l
         class_name_list: List chứa tên của class cần thêm (để có thể thay đổi nếu trùng).
         node: Node hiện tại đang được xử lý.
         merged_nodes: Danh sách các node đã được xử lý (để lấy thông tin summary).
+        summary_embeddings: Dictionary {summary: embedding} đã nhúng sẵn, None = nhúng riêng từng summary.
     """
     class_name = class_name_list[0]
     with onto:
@@ -158,12 +288,13 @@ def add_class_to_ontology(onto, model_embedding, parent_class_name, class_name_l
                 i += 1
 
         new_class = types.new_class(class_name_list[0], (parent_class,))
-        add_annotation_to_class(onto, model_embedding, new_class, node, merged_nodes)
+        add_annotation_to_class(onto, model_embedding, new_class, node, merged_nodes, summary_embeddings)
 
 
-def add_annotation_to_class(onto, model_embedding, owl_class, node, merged_nodes):
+def add_annotation_to_class(onto, model_embedding, owl_class, node, merged_nodes, summary_embeddings=None):
     """
     Thêm annotation 'summary' và 'summary_embeddings' cho một class.
+    Embedding được lấy từ summary_embeddings nếu có, nếu không thì nhúng riêng summary của node.
     """
     # Đảm bảo các annotation property tồn tại
     summary_prop = getattr(onto, "summary", None)
@@ -179,9 +310,12 @@ def add_annotation_to_class(onto, model_embedding, owl_class, node, merged_nodes
     summary_value = node.get("summarized_paragraph") # Đảm bảo key này đúng
     if summary_value:
         try:
-            summary_embedding = get_embedding(model_embedding, summary_value)
+            if summary_embeddings is not None and summary_value in summary_embeddings:
+                summary_embedding = summary_embeddings[summary_value]
+            else:
+                summary_embedding = get_embedding(model_embedding, summary_value)
             owl_class.summary = summary_value
-            owl_class.summary_embeddings = convert_embedding_to_string(summary_embedding)
+            owl_class.summary_embeddings = encode_embedding(summary_embedding)
         except NameError:
             print("Hàm get_embedding chưa được định nghĩa")
             owl_class.summary = summary_value
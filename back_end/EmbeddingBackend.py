@@ -0,0 +1,257 @@
+from abc import ABC, abstractmethod
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+DEFAULT_EMBEDDING_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+DEFAULT_ONNX_DIR = 'model/model_embedding_onnx'
+
+def _hub_model_name(model_name):
+    """Tên đầy đủ trên Hugging Face của model sentence-transformers (đường dẫn local được giữ nguyên)."""
+    if '/' in model_name or os.path.exists(model_name):
+        return model_name
+    return f"sentence-transformers/{model_name}"
+
+class EmbeddingBackend(ABC):
+    """
+    Giao diện chung của các backend nhúng văn bản, tương thích với SentenceTransformer.encode:
+    encode(str) trả về vector 1D, encode(list) trả về ma trận (số text, số chiều).
+    """
+    name = 'base'
+
+    @abstractmethod
+    def _encode_batch(self, texts, batch_size):
+        pass
+
+    def encode(self, sentences, show_progress_bar=False, batch_size=32, **kwargs):
+        single_text = isinstance(sentences, str)
+        texts = [sentences] if single_text else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = self._encode_batch(texts, batch_size)
+        return embeddings[0] if single_text else embeddings
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Model SentenceTransformer gốc (PyTorch float32)."""
+    name = 'float32'
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+        self.model = model
+
+    def _encode_batch(self, texts, batch_size):
+        return np.asarray(self.model.encode(texts, batch_size=batch_size, show_progress_bar=False))
+
+    def encode(self, sentences, show_progress_bar=False, batch_size=32, **kwargs):
+        return self.model.encode(sentences, show_progress_bar=show_progress_bar, batch_size=batch_size, **kwargs)
+
+class QuantizedTorchBackend(SentenceTransformerBackend):
+    """
+    Cùng model SentenceTransformer nhưng các lớp Linear được lượng tử hóa động sang int8 (torch.quantization),
+    chạy nhanh hơn trên CPU, không cần export model.
+    """
+    name = 'int8'
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+        import torch
+        super().__init__(model_name, model)
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class ONNXBackend(EmbeddingBackend):
+    """
+    Model được export sang ONNX và chạy bằng ONNX Runtime, có thể lượng tử hóa int8.
+    Embedding là trung bình các token theo attention mask (giống pooling của paraphrase-multilingual-MiniLM-L12-v2).
+    """
+    name = 'onnx'
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, onnx_dir=DEFAULT_ONNX_DIR, quantized=False, max_length=128):
+        """
+        Args:
+            model_name (str): Tên model trên Hugging Face (cần để lấy tokenizer và export lần đầu).
+            onnx_dir (str): Thư mục chứa model.onnx (và model_int8.onnx); được export nếu chưa có.
+            quantized (bool): Dùng model ONNX đã lượng tử hóa int8.
+            max_length (int): Số token tối đa của một text.
+        """
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.name = 'onnx-int8' if quantized else 'onnx'
+        self.max_length = max_length
+        onnx_path = export_onnx_model(model_name, onnx_dir, quantized=quantized)
+        tokenizer_source = onnx_dir if os.path.exists(os.path.join(onnx_dir, 'tokenizer_config.json')) else model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(_hub_model_name(tokenizer_source))
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode_batch(self, texts, batch_size):
+        # Sắp xếp theo độ dài để mỗi batch ít padding, rồi trả về đúng thứ tự ban đầu
+        order = np.argsort([len(text) for text in texts])
+        embeddings = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            batch_positions = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[position] for position in batch_positions], padding=True,
+                                     truncation=True, max_length=self.max_length, return_tensors='np')
+            inputs = {name: encoded[name].astype(np.int64) for name in encoded if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+            mask = encoded['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            for position, embedding in zip(batch_positions, pooled):
+                embeddings[position] = embedding
+        return np.stack(embeddings).astype(np.float32)
+
+def export_onnx_model(model_name=DEFAULT_EMBEDDING_MODEL, onnx_dir=DEFAULT_ONNX_DIR, quantized=False):
+    """
+    Export transformer của model sang ONNX (một lần) và lượng tử hóa động int8 nếu cần.
+    Returns:
+        str: Đường dẫn file .onnx.
+    """
+    onnx_path = os.path.join(onnx_dir, 'model.onnx')
+    quantized_path = os.path.join(onnx_dir, 'model_int8.onnx')
+
+    if not os.path.exists(onnx_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        os.makedirs(onnx_dir, exist_ok=True)
+        hub_name = _hub_model_name(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(hub_name)
+        model = AutoModel.from_pretrained(hub_name).eval()
+        tokenizer.save_pretrained(onnx_dir)
+        sample = tokenizer(["xin chào"], return_tensors='pt')
+        dynamic_axes = {'input_ids': {0: 'batch', 1: 'sequence'},
+                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                        'last_hidden_state': {0: 'batch', 1: 'sequence'}}
+        with torch.no_grad():
+            torch.onnx.export(model, (sample['input_ids'], sample['attention_mask']), onnx_path,
+                              input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+        print(f"Đã export model embedding sang ONNX: {onnx_path}")
+
+    if not quantized:
+        return onnx_path
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Đã lượng tử hóa model ONNX sang int8: {quantized_path}")
+    return quantized_path
+
+class EmbeddingDispatcher:
+    """
+    Gom các yêu cầu encode nhỏ từ nhiều thread (ví dụ các request chat chạy đồng thời) thành một batch.
+    Thread nền lấy yêu cầu từ hàng đợi, chờ thêm tối đa max_wait_ms hoặc đến khi đủ max_batch_size text
+    rồi encode một lần và trả kết quả qua Future. Khi không có tải, yêu cầu chỉ chờ thêm tối đa max_wait_ms.
+    Có thể dùng thay cho model embedding ở mọi nơi gọi .encode(...).
+    """
+
+    def __init__(self, model_embedding, max_batch_size=64, max_wait_ms=2.0):
+        """
+        Args:
+            model_embedding: Model hoặc EmbeddingBackend có hàm encode(list) trả về ma trận.
+            max_batch_size (int): Số text tối đa trong một batch. Yêu cầu lớn hơn được encode trực tiếp.
+            max_wait_ms (float): Thời gian chờ tối đa để gom thêm yêu cầu sau yêu cầu đầu tiên.
+        """
+        self.model = model_embedding
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        # Chỉ một batch được encode tại một thời điểm
+        self._model_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='embedding-dispatcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, texts):
+        """
+        Đưa một danh sách text vào hàng đợi.
+        Returns:
+            Future: Kết quả là ma trận embedding (len(texts), số chiều).
+        """
+        if self._closed:
+            raise RuntimeError("EmbeddingDispatcher đã bị đóng")
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, sentences, show_progress_bar=False, **kwargs):
+        single_text = isinstance(sentences, str)
+        texts = [sentences] if single_text else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if len(texts) > self.max_batch_size or kwargs:
+            # Yêu cầu lớn (ví dụ nhúng cả tài liệu) đã là một batch, không cần gom
+            with self._model_lock:
+                embeddings = np.asarray(self.model.encode(texts, show_progress_bar=show_progress_bar, **kwargs))
+        else:
+            embeddings = self.submit(texts).result()
+        return embeddings[0] if single_text else embeddings
+
+    def _collect_batch(self):
+        requests = [self._queue.get()]
+        if requests[0] is None:
+            return None
+        n_texts = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_texts < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            requests.append(request)
+            n_texts += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect_batch()
+            if requests is None:
+                return
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                with self._model_lock:
+                    embeddings = np.asarray(self.model.encode(texts, show_progress_bar=False))
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_texts, future in requests:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def close(self):
+        """Dừng thread nền sau khi xử lý hết các yêu cầu đang chờ."""
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+def create_embedding_backend(backend_name='float32', model_name=DEFAULT_EMBEDDING_MODEL, onnx_dir=DEFAULT_ONNX_DIR):
+    """
+    Tạo backend nhúng theo cấu hình.
+
+    Args:
+        backend_name (str): 'float32' (SentenceTransformer gốc), 'int8' (PyTorch lượng tử hóa động),
+                            'onnx' hoặc 'onnx-int8' (ONNX Runtime).
+    """
+    if backend_name == 'float32':
+        return SentenceTransformerBackend(model_name)
+    if backend_name == 'int8':
+        return QuantizedTorchBackend(model_name)
+    if backend_name in ('onnx', 'onnx-int8'):
+        try:
+            return ONNXBackend(model_name, onnx_dir, quantized=(backend_name == 'onnx-int8'))
+        except ImportError as e:
+            raise ImportError(f"EMBEDDING_BACKEND='{backend_name}' cần package '{e.name}' "
+                              f"(pip install onnx onnxruntime): {e}") from e
+    raise ValueError(f"Backend embedding không hợp lệ: {backend_name}")
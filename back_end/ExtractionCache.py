@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import time
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """
+    Tính SHA-256 của một file, đọc theo từng khối để không nạp cả file vào bộ nhớ.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# (path, mtime, size) -> sha256, tránh băm lại file model ở mỗi lần upload
+# và băm file PDF hai lần (khóa cache và khóa checkpoint) trong cùng một lần upload
+_file_fingerprints = {}
+_MAX_FILE_FINGERPRINTS = 256
+
+def file_fingerprint(file_path):
+    """
+    SHA-256 của một file (ví dụ file model), chỉ tính lại khi đường dẫn, thời điểm sửa hoặc kích thước thay đổi.
+    Trả về None nếu không có file.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return None
+    stat = os.stat(file_path)
+    stat_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    if stat_key not in _file_fingerprints:
+        if len(_file_fingerprints) >= _MAX_FILE_FINGERPRINTS:
+            # Bỏ mục cũ nhất, các file PDF upload lên không được giữ mãi
+            _file_fingerprints.pop(next(iter(_file_fingerprints)), None)
+        _file_fingerprints[stat_key] = file_sha256(file_path)
+    return _file_fingerprints[stat_key]
+
+def extraction_key(pdf_path, model_path=None, settings=None):
+    """
+    Khóa của một lần trích xuất PDF, dùng chung cho PDFExtractionCache và IngestionCheckpoint:
+    SHA-256 nội dung file PDF, dấu vân tay file model layout và các tham số xử lý.
+    """
+    key_data = {
+        'pdf_sha256': file_fingerprint(pdf_path),
+        'model_fingerprint': file_fingerprint(model_path),
+        'settings': settings or {},
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+class PDFExtractionCache:
+    """
+    Cache trên đĩa cho kết quả process_full_pdf, được đánh địa chỉ theo nội dung:
+    khóa là SHA-256 của nội dung file PDF cùng với dấu vân tay của model layout và các tham số xử lý.
+    Mỗi mục là một file JSON; khi tổng dung lượng vượt max_bytes, các mục ít được dùng gần đây nhất bị xóa (LRU).
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Thư mục lưu cache.
+            max_bytes (int): Dung lượng tối đa của cache.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def model_fingerprint(self, model_path):
+        """
+        Dấu vân tay của file model layout. File model thay đổi thì khóa cache cũng thay đổi.
+        """
+        return file_fingerprint(model_path)
+
+    def make_key(self, pdf_path, model_path=None, settings=None):
+        """
+        Tạo khóa cache từ nội dung file PDF, file model và các tham số xử lý.
+        Returns:
+            tuple: (key, model_fingerprint)
+        """
+        return extraction_key(pdf_path, model_path, settings), self.model_fingerprint(model_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Lấy kết quả đã cache. Trả về None nếu không có.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # Cập nhật thời điểm truy cập cho LRU
+        now = time.time()
+        os.utime(entry_path, (now, now))
+        return entry['result']
+
+    def put(self, key, result, model_fingerprint=None):
+        """
+        Lưu kết quả vào cache rồi xóa bớt các mục cũ nếu vượt dung lượng.
+        """
+        entry = {
+            'key': key,
+            'model_fingerprint': model_fingerprint,
+            'created_at': time.time(),
+            'result': result,
+        }
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            entry_path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return entries
+
+    def evict(self):
+        """
+        Xóa các mục ít được dùng gần đây nhất cho đến khi tổng dung lượng <= max_bytes.
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+                total_size -= size
+                print(f"🗑️  Xóa cache cũ: {entry_path}")
+            except FileNotFoundError:
+                pass
+
+    def invalidate_model(self, model_path):
+        """
+        Xóa các mục được tạo bởi một phiên bản model khác với file model hiện tại.
+        Returns:
+            int: Số mục đã xóa.
+        """
+        current_fingerprint = self.model_fingerprint(model_path)
+        removed = 0
+        for _, _, entry_path in self._entries():
+            try:
+                with open(entry_path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if entry.get('model_fingerprint') != current_fingerprint:
+                os.remove(entry_path)
+                removed += 1
+        print(f"Đã xóa {removed} mục cache của model cũ")
+        return removed
+
+    def clear(self):
+        """Xóa toàn bộ cache."""
+        for _, _, entry_path in self._entries():
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.spatial.distance import cdist
+from scipy.cluster.hierarchy import linkage
 from sklearn.metrics.pairwise import cosine_similarity
 
 def find_optimal_k_elbow(k_range, inertias, method='knee', plot=True):
@@ -238,6 +239,63 @@ def get_safe_k_range(n_samples, min_k=2, max_k=None):
 
     return range(min_k, max_k + 1 )
 
+def linkage_wcss_curve(normalized_embeddings, k_range, method='ward'):
+    """
+    Tính WCSS cho mọi k trong k_range từ một lần phân cụm phân cấp (agglomerative),
+    thay cho việc chạy K-Means riêng cho từng k.
+
+    Parameters:
+    -----------
+    normalized_embeddings : np.ndarray
+        Ma trận embedding đã chuẩn hóa (khoảng cách euclid tương đương cosine)
+    k_range : range hoặc list
+        Các giá trị k cần tính WCSS
+    method : str
+        'ward' - mỗi lần gộp của scipy có chiều cao d với WCSS tăng đúng d²/2
+        'average' - average linkage theo khoảng cách cosine, WCSS được cập nhật khi gộp từng cặp cụm
+
+    Returns:
+    --------
+    inertias : list
+        WCSS tương ứng với mỗi k trong k_range (k >= số điểm thì WCSS = 0)
+    """
+    X = np.asarray(normalized_embeddings, dtype=np.float64)
+    n_samples = X.shape[0]
+    k_values = list(k_range)
+    if n_samples < 2:
+        return [0.0 for _ in k_values]
+
+    # wcss_after_merges[m] = WCSS sau m lần gộp, tức là khi còn n_samples - m cụm
+    if method == 'ward':
+        merge_heights = linkage(X, method='ward')[:, 2]
+        wcss_after_merges = np.concatenate([[0.0], np.cumsum(merge_heights ** 2 / 2)])
+    elif method == 'average':
+        merges = linkage(X, method='average', metric='cosine')[:, :2].astype(int)
+        # Mỗi cụm chỉ cần lưu tổng vector, tổng bình phương chuẩn và số điểm để tính WCSS
+        sums = np.zeros((2 * n_samples - 1, X.shape[1]))
+        sums[:n_samples] = X
+        square_norms = np.zeros(2 * n_samples - 1)
+        square_norms[:n_samples] = np.einsum('ij,ij->i', X, X)
+        sizes = np.zeros(2 * n_samples - 1)
+        sizes[:n_samples] = 1
+        cluster_wcss = np.zeros(2 * n_samples - 1)
+
+        wcss_after_merges = np.zeros(n_samples)
+        total_wcss = 0.0
+        for step, (left, right) in enumerate(merges):
+            new_cluster = n_samples + step
+            sums[new_cluster] = sums[left] + sums[right]
+            square_norms[new_cluster] = square_norms[left] + square_norms[right]
+            sizes[new_cluster] = sizes[left] + sizes[right]
+            cluster_wcss[new_cluster] = (square_norms[new_cluster]
+                                         - sums[new_cluster] @ sums[new_cluster] / sizes[new_cluster])
+            total_wcss += cluster_wcss[new_cluster] - cluster_wcss[left] - cluster_wcss[right]
+            wcss_after_merges[step + 1] = total_wcss
+    else:
+        raise ValueError("Method phải là 'ward' hoặc 'average'")
+
+    return [float(wcss_after_merges[n_samples - k]) if 1 <= k < n_samples else 0.0 for k in k_values]
+
 def should_merge_to_single_cluster(list_paragraphs, embeddings=None, clusterer=None, strategy='adaptive'):
     """
     Quyết định có nên gom tất cả về 1 cụm cuối cùng hay không
@@ -324,9 +382,17 @@ def should_merge_to_single_cluster(list_paragraphs, embeddings=None, clusterer=N
         # Mặc định: chỉ gom khi còn 2 đoạn
         return n_paragraphs <= 2
 
-def get_optimal_k_with_final_merge_logic(list_paragraphs, clusterer, strategy='adaptive'):
+def get_optimal_k_with_final_merge_logic(list_paragraphs, clusterer, strategy='adaptive', k_engine='kmeans',
+                                         kmeans_sweep_options=None):
     """
     Lấy số cụm tối ưu với logic gom cụm cuối thông minh
+
+    Args:
+        k_engine: Cách tính đường cong WCSS theo k:
+                  'kmeans' - chạy MiniBatchKMeans cho từng k (find_optimal_clusters_elbow),
+                  'ward' / 'average' - đọc WCSS của mọi k từ một lần phân cụm phân cấp (linkage_wcss_curve).
+        kmeans_sweep_options: dict tham số thêm cho find_optimal_clusters_elbow khi k_engine='kmeans'
+                              (ví dụ: n_jobs, warm_start, early_stop_patience).
     """
     n_paragraphs = len(list_paragraphs)
 
@@ -351,7 +417,13 @@ def get_optimal_k_with_final_merge_logic(list_paragraphs, clusterer, strategy='a
 
     k_test_range = get_safe_k_range(len(list_paragraphs), min_k=1, max_k=None)
 
-    inertias = clusterer.find_optimal_clusters_elbow(k_test_range)
+    if k_engine == 'kmeans':
+        inertias = clusterer.find_optimal_clusters_elbow(k_test_range, **(kmeans_sweep_options or {}))
+        # Sweep có thể dừng sớm, chỉ chọn k trong phần đã tính
+        k_test_range = k_test_range[:len(inertias)]
+    else:
+        print(f"Đang tính WCSS cho k từ {k_test_range.start} đến {k_test_range.stop - 1} bằng {k_engine} linkage...")
+        inertias = linkage_wcss_curve(clusterer.normalized_embeddings, k_test_range, method=k_engine)
 
     if inertias:
         optimal_k = auto_select_optimal_k(k_test_range, inertias, show_comparison=True)
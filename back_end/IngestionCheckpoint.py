@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from ExtractionCache import extraction_key
+
+# Các thư mục job đang được một lần chạy trong tiến trình này sử dụng
+_held_job_dirs = set()
+_held_job_dirs_lock = threading.Lock()
+
+def _pid_alive(pid):
+    """Tiến trình pid còn chạy không. Ngoài POSIX không kiểm tra được nên coi là còn chạy."""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def text_sha256(text):
+    """SHA-256 của một đoạn text, dùng để kiểm tra kết quả đã lưu có đúng với đoạn văn hiện tại không."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class IngestionCheckpoint:
+    """
+    Lưu kết quả trung gian của quá trình xử lý một tài liệu vào thư mục job để có thể chạy tiếp
+    từ đơn vị đã hoàn thành cuối cùng khi lần chạy trước bị lỗi.
+    - pages.jsonl: paragraphs của từng trang đã xử lý xong.
+    - <stage>.jsonl: kết quả của từng đoạn văn cho một bước (ví dụ: 'summary', 'keyword').
+    Mỗi kết quả được ghi thêm thành một dòng ngay khi hoàn thành; dòng ghi dở do lỗi sẽ bị bỏ qua khi đọc lại.
+    Một thư mục job chỉ được một lần chạy sử dụng tại một thời điểm (file .lock chứa pid của tiến trình).
+    """
+
+    LOCK_FILENAME = '.lock'
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self._locked = False
+        # Thư mục riêng của một lần chạy trùng với lần chạy khác, bị xóa khi kết thúc
+        self._private = False
+        os.makedirs(job_dir, exist_ok=True)
+
+    @staticmethod
+    def job_key(pdf_path, settings=None, model_path=None):
+        """
+        Khóa của job: giống khóa của PDFExtractionCache (xem ExtractionCache.extraction_key),
+        để lần chạy lại với cấu hình khác không trộn các trang được trích xuất bằng cấu hình cũ.
+        """
+        return extraction_key(pdf_path, model_path, settings)
+
+    @classmethod
+    def for_pdf(cls, root_dir, pdf_path, settings=None, model_path=None):
+        """
+        Tạo checkpoint cho một file PDF, thư mục job được đặt theo job_key
+        để lần upload lại cùng file với cùng cấu hình sẽ dùng lại kết quả đã có.
+        Thư mục job được khóa cho lần chạy này. Nếu một lần chạy khác đang dùng nó (ví dụ hai upload
+        cùng một file cùng lúc), lần chạy này dùng một thư mục riêng, không tiếp tục từ checkpoint.
+        Sau khi xong phải gọi clear() (thành công) hoặc release() (lỗi, giữ lại để chạy tiếp).
+
+        Args:
+            settings (dict): Các tham số trích xuất (xem PDF_Processor.extraction_settings).
+            model_path (str): Đường dẫn file model layout.
+        """
+        key = cls.job_key(pdf_path, settings, model_path)
+        checkpoint = cls(os.path.join(root_dir, key))
+        if checkpoint.acquire():
+            return checkpoint
+
+        print(f"⚠️  Job {key[:12]} đang được xử lý bởi lần chạy khác, dùng thư mục checkpoint riêng")
+        checkpoint = cls(os.path.join(root_dir, f"{key}-{uuid.uuid4().hex[:8]}"))
+        checkpoint._private = True
+        checkpoint.acquire()
+        return checkpoint
+
+    def _lock_path(self):
+        return os.path.join(self.job_dir, self.LOCK_FILENAME)
+
+    def _lock_is_stale(self):
+        """File .lock còn lại từ một lần chạy đã kết thúc bất thường (tiến trình không còn chạy)."""
+        try:
+            with open(self._lock_path(), 'r') as f:
+                pid = int(f.read().strip())
+        except FileNotFoundError:
+            return True
+        except ValueError:
+            return True
+        if pid == os.getpid():
+            # Lần chạy trong tiến trình này đang giữ job thì đã có trong _held_job_dirs (được kiểm tra trước)
+            return True
+        return not _pid_alive(pid)
+
+    def acquire(self):
+        """
+        Khóa thư mục job cho lần chạy hiện tại.
+        Returns:
+            bool: True nếu khóa được, False nếu một lần chạy khác đang dùng thư mục này.
+        """
+        job_dir = os.path.abspath(self.job_dir)
+        with _held_job_dirs_lock:
+            if self._locked:
+                return True
+            if job_dir in _held_job_dirs:
+                return False
+            for _ in range(2):
+                try:
+                    fd = os.open(self._lock_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    if not self._lock_is_stale():
+                        return False
+                    try:
+                        os.remove(self._lock_path())
+                    except FileNotFoundError:
+                        pass
+                    continue
+                with os.fdopen(fd, 'w') as f:
+                    f.write(str(os.getpid()))
+                _held_job_dirs.add(job_dir)
+                self._locked = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Mở khóa thư mục job khi lần chạy kết thúc mà chưa xong (kết quả được giữ lại để chạy tiếp).
+        Thư mục riêng của lần chạy trùng bị xóa luôn.
+        """
+        if self._private:
+            self.clear()
+            return
+        with _held_job_dirs_lock:
+            if not self._locked:
+                return
+            try:
+                os.remove(self._lock_path())
+            except FileNotFoundError:
+                pass
+            _held_job_dirs.discard(os.path.abspath(self.job_dir))
+            self._locked = False
+
+    def _path(self, name):
+        return os.path.join(self.job_dir, f"{name}.jsonl")
+
+    def _append(self, name, record):
+        with open(self._path(name), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self, name):
+        records = []
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    def save_page(self, page_index, paragraphs):
+        """Lưu paragraphs của một trang đã xử lý xong."""
+        self._append('pages', {'page_index': page_index, 'paragraphs': paragraphs})
+
+    def load_pages(self):
+        """
+        Returns:
+            dict: {page_index: paragraphs} của các trang đã xử lý xong.
+        """
+        return {record['page_index']: record['paragraphs'] for record in self._read('pages')}
+
+    def save_result(self, stage, position, text, value):
+        """
+        Lưu kết quả của một đoạn văn cho một bước xử lý.
+        Args:
+            stage (str): Tên bước, ví dụ 'summary'.
+            position (int): Vị trí đoạn văn trong danh sách.
+            text (str): Nội dung đầu vào của bước, dùng để kiểm tra khi đọc lại.
+            value: Kết quả (phải serialize được bằng JSON).
+        """
+        self._append(stage, {'position': position, 'text_sha256': text_sha256(text), 'value': value})
+
+    def load_results(self, stage, texts):
+        """
+        Đọc các kết quả đã lưu của một bước, chỉ giữ kết quả có đầu vào trùng với texts hiện tại.
+        Returns:
+            dict: {position: value}
+        """
+        results = {}
+        for record in self._read(stage):
+            position = record['position']
+            if position < len(texts) and record['text_sha256'] == text_sha256(texts[position]):
+                results[position] = record['value']
+        return results
+
+    def clear(self):
+        """
+        Xóa thư mục job sau khi toàn bộ quá trình xử lý thành công.
+        Không xóa nếu thư mục đang bị một lần chạy khác khóa.
+        """
+        job_dir = os.path.abspath(self.job_dir)
+        with _held_job_dirs_lock:
+            if not self._locked and (job_dir in _held_job_dirs
+                                     or (os.path.exists(self._lock_path()) and not self._lock_is_stale())):
+                print(f"⚠️  Không xóa checkpoint {self.job_dir}: đang được lần chạy khác sử dụng")
+                return
+            shutil.rmtree(self.job_dir, ignore_errors=True)
+            _held_job_dirs.discard(job_dir)
+            self._locked = False
+
+def map_with_checkpoint(func, texts, checkpoint=None, stage=None, executor=None):
+    """
+    Áp dụng func cho từng đoạn văn, bỏ qua các đoạn đã có kết quả trong checkpoint
+    và lưu kết quả mới ngay khi mỗi đoạn hoàn thành.
+    Args:
+        func (callable): Hàm nhận một đoạn văn, trả về kết quả.
+        texts (list): Danh sách đoạn văn.
+        checkpoint (IngestionCheckpoint): Checkpoint của job, None = không lưu.
+        stage (str): Tên bước trong checkpoint.
+        executor (LLMExecutor): Nếu có, các đoạn còn lại được xử lý đồng thời, None = tuần tự.
+    Returns:
+        list: Kết quả theo đúng thứ tự texts.
+    """
+    results = checkpoint.load_results(stage, texts) if checkpoint is not None else {}
+    if results:
+        print(f"♻️  Bước '{stage}': dùng lại {len(results)}/{len(texts)} kết quả từ checkpoint")
+
+    pending = [(position, text) for position, text in enumerate(texts) if position not in results]
+    if executor is not None:
+        completed = executor.iter_completed(func, pending)
+    else:
+        completed = ((position, func(text)) for position, text in pending)
+
+    # Checkpoint chỉ được ghi từ thread hiện tại
+    for position, value in completed:
+        results[position] = value
+        if checkpoint is not None:
+            checkpoint.save_result(stage, position, texts[position], value)
+    return [results[position] for position in range(len(texts))]
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+class LLMResponseCache:
+    """
+    Cache trên đĩa (SQLite) cho kết quả chat.completions, khóa là SHA-256 của model, temperature,
+    các messages (system prompt + nội dung) và các tham số khác của request.
+    Khi tổng dung lượng vượt max_bytes, các mục ít được dùng gần đây nhất bị xóa (LRU).
+    Dùng chung được giữa nhiều thread.
+    """
+
+    def __init__(self, db_path, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            db_path (str): Đường dẫn file SQLite.
+            max_bytes (int): Tổng dung lượng tối đa của nội dung được cache.
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(request_kwargs):
+        """Khóa cache của một request, không phụ thuộc thứ tự các tham số."""
+        data = json.dumps(request_kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Lấy kết quả đã cache. Trả về None nếu không có.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Lưu kết quả vào cache rồi xóa bớt các mục cũ nếu vượt dung lượng.
+        """
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                old_row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, data, size, now, now))
+            self._total_bytes += size - (old_row[0] if old_row else 0)
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        removed = 0
+        with self._connection:
+            rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                removed += 1
+        print(f"🗑️  Xóa {removed} mục cache LLM cũ")
+
+    def stats(self):
+        """
+        Returns:
+            dict: Số lần hit/miss, tỉ lệ hit, số mục và dung lượng của cache.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': entries,
+                'bytes': self._total_bytes,
+            }
+
+    def clear(self):
+        """Xóa toàn bộ cache."""
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+def _response_to_dict(response):
+    choice = response.choices[0]
+    return {
+        'model': getattr(response, 'model', None),
+        'content': choice.message.content,
+        'finish_reason': getattr(choice, 'finish_reason', None),
+    }
+
+def _response_from_dict(data):
+    """Dựng lại đối tượng có cùng cách truy cập với response của OpenAI: response.choices[0].message.content."""
+    message = SimpleNamespace(role='assistant', content=data['content'])
+    choice = SimpleNamespace(index=0, message=message, finish_reason=data.get('finish_reason'))
+    return SimpleNamespace(model=data.get('model'), choices=[choice], usage=None)
+
+class _CachedCompletions:
+    def __init__(self, completions, cache):
+        self._completions = completions
+        self._cache = cache
+
+    def create(self, **kwargs):
+        # Chỉ cache request có kết quả xác định (temperature=0) và không stream
+        if kwargs.get('temperature') != 0 or kwargs.get('stream'):
+            return self._completions.create(**kwargs)
+
+        key = self._cache.make_key(kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return _response_from_dict(cached)
+
+        response = self._completions.create(**kwargs)
+        if response.choices and response.choices[0].message.content is not None:
+            self._cache.put(key, _response_to_dict(response))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+class _CachedChat:
+    def __init__(self, chat, cache):
+        self._chat = chat
+        self.completions = _CachedCompletions(chat.completions, cache)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+class CachedChatClient:
+    """
+    Bọc OpenAI client để client.chat.completions.create đi qua LLMResponseCache.
+    Các thuộc tính khác được chuyển thẳng cho client gốc, nên có thể dùng thay cho client ở mọi nơi.
+    """
+
+    def __init__(self, client, cache):
+        self._client = client
+        self.cache = cache
+        self.chat = _CachedChat(client.chat, cache)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
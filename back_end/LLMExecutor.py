@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from openai import APIConnectionError, APITimeoutError
+    _CONNECTION_ERRORS = (APIConnectionError, APITimeoutError, ConnectionError, TimeoutError)
+except ImportError:
+    _CONNECTION_ERRORS = (ConnectionError, TimeoutError)
+
+def _status_code(error):
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code
+
+def is_retryable_error(error):
+    """
+    Lỗi có nên gọi lại không: bị giới hạn tốc độ (429), lỗi phía server (5xx) hoặc lỗi kết nối.
+    """
+    if isinstance(error, _CONNECTION_ERRORS):
+        return True
+    status_code = _status_code(error)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+def _retry_after_seconds(error):
+    """Thời gian chờ server yêu cầu trong header Retry-After (nếu có)."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class LLMExecutor:
+    """
+    Gọi LLM đồng thời cho nhiều đoạn văn bằng thread pool:
+    - Giới hạn số request đang chạy cùng lúc bằng max_in_flight, tính chung cho mọi lần gọi map/iter_completed
+      trên cùng một executor (ví dụ nhiều upload đồng thời trên server).
+    - Gọi lại khi gặp lỗi 429/5xx/lỗi kết nối, chờ theo Retry-After hoặc exponential backoff có jitter.
+    - Kết quả trả về giữ đúng thứ tự đầu vào.
+    """
+
+    def __init__(self, max_in_flight=8, max_retries=5, base_delay=1.0, max_delay=30.0):
+        """
+        Args:
+            max_in_flight (int): Số request tối đa chạy cùng lúc trên executor này.
+            max_retries (int): Số lần gọi lại tối đa cho mỗi đoạn văn.
+            base_delay (float): Thời gian chờ (giây) trước lần gọi lại đầu tiên.
+            max_delay (float): Thời gian chờ tối đa giữa hai lần gọi.
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+    def _backoff_delay(self, attempt, error):
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        # Jitter để các thread bị giới hạn cùng lúc không gọi lại cùng lúc
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def call(self, func, *args):
+        """
+        Gọi func(*args), gọi lại khi gặp lỗi tạm thời. Lỗi khác hoặc hết số lần gọi lại thì raise.
+        Mỗi lần gọi giữ một chỗ trong max_in_flight, thời gian chờ backoff không giữ chỗ.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self._in_flight:
+                    return func(*args)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                print(f"⚠️  Lỗi gọi LLM ({type(e).__name__}), thử lại sau {delay:.1f}s "
+                      f"(lần {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                attempt += 1
+
+    def iter_completed(self, func, items):
+        """
+        Gọi func cho từng phần tử, trả về (position, result) theo thứ tự hoàn thành.
+        Nếu một phần tử lỗi, các phần tử đang chạy vẫn được chờ xong rồi mới raise lỗi đầu tiên.
+        """
+        first_error = None
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            futures = {pool.submit(self.call, func, item): position for position, item in items}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Lỗi gọi LLM cho đoạn {futures[future]}: {str(e)}")
+                    first_error = first_error or e
+                    continue
+                yield futures[future], result
+        if first_error is not None:
+            raise first_error
+
+    def map(self, func, items):
+        """
+        Returns:
+            list: Kết quả theo đúng thứ tự items.
+        """
+        results = dict(self.iter_completed(func, enumerate(items)))
+        return [results[position] for position in range(len(items))]
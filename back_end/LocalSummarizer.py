@@ -0,0 +1,123 @@
+import re
+from collections import Counter
+import numpy as np
+from sklearn.preprocessing import normalize
+
+# Ranh giới câu: dấu kết thúc câu, theo sau là khoảng trắng hoặc dấu '#' (normalize_block_text đánh dấu cuối câu bằng '#')
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?…])[\s#]+')
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Các từ không được đứng đầu/cuối một cụm từ khóa
+VIETNAMESE_STOPWORDS = {
+    'và', 'của', 'là', 'các', 'những', 'được', 'trong', 'cho', 'với', 'đã', 'có', 'không', 'này', 'đó', 'một',
+    'khi', 'để', 'từ', 'theo', 'về', 'như', 'thì', 'mà', 'ra', 'vào', 'lại', 'cũng', 'nhưng', 'đến', 'tại', 'bị',
+    'do', 'sau', 'trên', 'dưới', 'rất', 'nhiều', 'nên', 'vì', 'hay', 'hoặc', 'còn', 'sẽ', 'đang', 'nào', 'ở',
+    'bởi', 'qua', 'năm', 'ngày', 'tháng',
+}
+
+class LocalSummarizer:
+    """
+    Tóm tắt trích xuất và tách từ khóa chạy trên máy bằng model embedding đã nạp, không gọi LLM.
+    - Tóm tắt: chọn các câu có điểm cao nhất theo độ tương đồng với tâm đoạn văn (centroid)
+      và độ trung tâm trong đồ thị tương đồng giữa các câu (kiểu TextRank), giữ nguyên thứ tự câu.
+    - Từ khóa: chọn cụm n-gram gần nghĩa nhất với toàn đoạn văn (kiểu KeyBERT).
+    Các câu và cụm từ của nhiều đoạn văn được nhúng chung trong một lần encode.
+    """
+
+    def __init__(self, model_embedding, max_sentences=3, summary_ratio=0.3, ngram_range=(2, 4),
+                 max_candidates=100, centroid_weight=0.5):
+        """
+        Args:
+            model_embedding: Model SentenceTransformer (ví dụ 'paraphrase-multilingual-MiniLM-L12-v2').
+            max_sentences (int): Số câu tối đa của bản tóm tắt.
+            summary_ratio (float): Tỉ lệ số câu được giữ lại so với đoạn văn.
+            ngram_range (tuple): Độ dài (số âm tiết) nhỏ nhất và lớn nhất của cụm từ khóa.
+            max_candidates (int): Số cụm từ ứng viên (xuất hiện nhiều nhất) được xét cho mỗi đoạn văn.
+            centroid_weight (float): Trọng số của điểm centroid, phần còn lại là điểm TextRank.
+        """
+        self.model = model_embedding
+        self.max_sentences = max_sentences
+        self.summary_ratio = summary_ratio
+        self.ngram_range = ngram_range
+        self.max_candidates = max_candidates
+        self.centroid_weight = centroid_weight
+
+    @staticmethod
+    def split_sentences(text):
+        return [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text)
+                if sentence.strip(' #')]
+
+    def candidate_phrases(self, text):
+        """
+        Các cụm n-gram liên tiếp trong cùng một câu, không bắt đầu/kết thúc bằng stopword hoặc số.
+        """
+        counts = Counter()
+        min_n, max_n = self.ngram_range
+        for sentence in self.split_sentences(text):
+            words = WORD_PATTERN.findall(sentence)
+            lower_words = [word.lower() for word in words]
+            for n in range(min_n, max_n + 1):
+                for start in range(len(words) - n + 1):
+                    first, last = lower_words[start], lower_words[start + n - 1]
+                    if (first in VIETNAMESE_STOPWORDS or last in VIETNAMESE_STOPWORDS
+                            or first.isdigit() or last.isdigit()):
+                        continue
+                    counts[' '.join(words[start:start + n])] += 1
+        return [phrase for phrase, _ in counts.most_common(self.max_candidates)]
+
+    def _encode(self, texts):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize(self.model.encode(texts, show_progress_bar=False), axis=1)
+
+    def _select_sentences(self, sentence_embeddings, n_select):
+        centroid = sentence_embeddings.mean(axis=0)
+        centroid_scores = sentence_embeddings @ (centroid / (np.linalg.norm(centroid) or 1.0))
+        similarity = sentence_embeddings @ sentence_embeddings.T
+        np.fill_diagonal(similarity, 0.0)
+        # Độ trung tâm bậc (degree centrality) trên đồ thị tương đồng, xấp xỉ một bước của TextRank
+        centrality_scores = np.clip(similarity, 0.0, None).sum(axis=1)
+        centrality_scores = centrality_scores / (centrality_scores.max() or 1.0)
+        scores = self.centroid_weight * centroid_scores + (1 - self.centroid_weight) * centrality_scores
+        return sorted(np.argsort(-scores)[:n_select])
+
+    def summarize_and_extract_keywords(self, texts):
+        """
+        Tóm tắt và tách từ khóa cho nhiều đoạn văn.
+
+        Returns:
+            list: Các tuple (summary, keyword) theo thứ tự texts.
+        """
+        sentences_per_text = [self.split_sentences(text) for text in texts]
+        candidates_per_text = [self.candidate_phrases(text) for text in texts]
+
+        all_sentences = [sentence for sentences in sentences_per_text for sentence in sentences]
+        unique_candidates = sorted({phrase for phrases in candidates_per_text for phrase in phrases})
+        sentence_embeddings = self._encode(all_sentences)
+        text_embeddings = self._encode(list(texts))
+        candidate_embeddings = self._encode(unique_candidates)
+        candidate_rows = {phrase: row for row, phrase in enumerate(unique_candidates)}
+
+        results = []
+        offset = 0
+        for position, (text, sentences, candidates) in enumerate(zip(texts, sentences_per_text, candidates_per_text)):
+            n_sentences = len(sentences)
+            n_select = max(1, min(self.max_sentences, int(round(n_sentences * self.summary_ratio))))
+            if n_sentences <= n_select:
+                summary = ' '.join(sentences) if sentences else text
+            else:
+                selected = self._select_sentences(sentence_embeddings[offset:offset + n_sentences], n_select)
+                summary = ' '.join(sentences[i] for i in selected)
+            offset += n_sentences
+
+            if candidates:
+                scores = candidate_embeddings[[candidate_rows[phrase] for phrase in candidates]] @ text_embeddings[position]
+                keyword = candidates[int(np.argmax(scores))]
+            else:
+                keyword = ' '.join(WORD_PATTERN.findall(text)[:self.ngram_range[1]])
+            results.append((summary, keyword))
+        return results
+
+    def summarize_and_extract_keyword(self, text):
+        """Tóm tắt và tách từ khóa cho một đoạn văn. Returns: tuple (summary, keyword)."""
+        return self.summarize_and_extract_keywords([text])[0]
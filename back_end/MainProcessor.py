@@ -2,26 +2,45 @@ from PDF_Processor import *
 from RunBuildTree import *
 from CreateOnology import *
 import time
-def process_PDF_file(client, model_embedding, model_detect_layout, reader, PDF_file_path):
+def process_PDF_file(client, model_embedding, model_detect_layout, reader, PDF_file_path, pdf_options=None,
+                     checkpoint=None, llm_executor=None, extraction_mode='separate',
+                     batch_backend=None, llm_min_round=None, embedding_store=None, k_engine='kmeans',
+                     kmeans_sweep_options=None, tree_engine='rounds', branching_factor=4):
     '''
     Tạo ra cây phân cấp từ file PDF.
     Args:
         PDF_file_path: đường dẫn đến file PDF trong thư mục upload
+        pdf_options: dict các tham số thêm cho process_full_pdf (ví dụ: num_workers, layout_model_path)
+        checkpoint: IngestionCheckpoint để lần chạy lại tiếp tục từ trang/đoạn văn đã xong
+        llm_executor: LLMExecutor để tóm tắt và tách từ khóa đồng thời
+        extraction_mode: cách tóm tắt và tách từ khóa ('separate', 'combined', 'packed', 'batch', 'local')
+        batch_backend: BatchBackend cho extraction_mode='batch'
+        llm_min_round: các node từ vòng này trở lên được tóm tắt lại bằng LLM
+        embedding_store: EmbeddingStore dùng chung với create_ontology để không nhúng lại các summary
+        k_engine: cách tính WCSS khi chọn số cụm mỗi vòng ('kmeans', 'ward', 'average')
+        kmeans_sweep_options: dict tham số thêm cho sweep K-Means (n_jobs, warm_start, early_stop_patience)
+        tree_engine: cách dựng các tầng của cây ('rounds' = phân cụm từng vòng, 'linkage' = một lần linkage)
+        branching_factor: số con trung bình của một node khi tree_engine='linkage'
 
     Returns:
         list các dict có index và parent_index để tạo cây
     '''
-    pdf_result = process_full_pdf(model_detect_layout, reader, PDF_file_path)
-    s_time = time.time()
-    merged_result = merge_short_paragraphs(pdf_result['all_paragraphs'])
-    e_time = time.time()
-    print(f"Thời gian merge: {e_time - s_time}s")
-
-    result = run_clustering_with_tree_building(client, model_embedding, merged_result, clustering_strategy='adaptive')
+    # Các đoạn ngắn được gộp ngay trong lúc trích xuất từng trang (chế độ tuần tự, không có cache)
+    pdf_result = process_full_pdf(model_detect_layout, reader, PDF_file_path, checkpoint=checkpoint, merge_n_word=200,
+                                  **(pdf_options or {}))
+    merged_result = pdf_result['merged_paragraphs']
+
+    result = run_clustering_with_tree_building(client, model_embedding, merged_result, clustering_strategy='adaptive',
+                                               checkpoint=checkpoint, llm_executor=llm_executor,
+                                               extraction_mode=extraction_mode, batch_backend=batch_backend,
+                                               llm_min_round=llm_min_round, embedding_store=embedding_store,
+                                               k_engine=k_engine, kmeans_sweep_options=kmeans_sweep_options,
+                                               tree_engine=tree_engine, branching_factor=branching_factor)
     clustering_tree = result['tree']
     return clustering_tree
 
-def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri):
+def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri, embedding_store=None,
+                    embedding_sidecar=False):
     """
     Tạo ontology dựa vào cấu trúc index và index_parent từ merged_nodes.
     Thêm annotation 'summary' cho mỗi class.
@@ -29,6 +48,8 @@ def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri):
     Args:
         merged_nodes: List các node đã được xử lý từ hàm merge_short_nodes
         ontology_iri: IRI của ontology
+        embedding_store: EmbeddingStore của bước phân cụm để dùng lại embedding của các summary
+        embedding_sidecar: ghi thêm file .embeddings.npz chứa embedding của các class cạnh file ontology
 
     Returns:
         Đối tượng ontology đã được tạo
@@ -50,6 +71,9 @@ def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri):
         class_name = clean_class_name(class_name)
         class_names[index] = class_name
 
+    # Nhúng summary của tất cả các node một lần thay vì từng node
+    summary_embeddings = encode_node_summaries(model_embedding, merged_nodes, embedding_store)
+
     # Bước 2: Tạo annotation properties
     with onto:
         safe_add_annotation_property(onto, "summary")
@@ -70,7 +94,8 @@ def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri):
         with onto:
             main_root_class = types.new_class(root_class_name, (Thing,))
             # Thêm summary và summary_embeddings cho root_class
-            add_annotation_to_class(onto,model_embedding, main_root_class, root_node_info, merged_nodes)
+            add_annotation_to_class(onto,model_embedding, main_root_class, root_node_info, merged_nodes,
+                                    summary_embeddings)
 
         # Đặt index của root_node làm parent_index để các node con của nó được xử lý
         initial_parent_to_process = root_node_info["index"]
@@ -106,12 +131,16 @@ def create_ontology(model_embedding, merged_nodes, save_path, ontology_iri):
 
         class_name_list = [class_name]
         # Thêm class con vào ontology, gắn nó với main_root_class
-        add_class_to_ontology(onto,model_embedding, parent_class_name, class_name_list, node, merged_nodes)
+        add_class_to_ontology(onto,model_embedding, parent_class_name, class_name_list, node, merged_nodes,
+                              summary_embeddings)
         class_names[index] = class_name_list[0] # Cập nhật tên nếu có thay đổi
 
         # Đệ quy xử lý các node con của node hiện tại
-        process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, index)
+        process_nodes_level_by_level(onto, model_embedding, nodes_by_parent, class_names, merged_nodes, index,
+                                     summary_embeddings)
 
     onto.save(save_path)
+    if embedding_sidecar:
+        save_embedding_sidecar(onto, save_path)
 
     return onto
\ No newline at end of file
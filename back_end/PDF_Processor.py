@@ -1,7 +1,26 @@
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bisect import bisect_left, bisect_right
+import heapq
+import json
+import multiprocessing
 import fitz
 import numpy as np
 import time
+from LLMExecutor import is_retryable_error
+
+# Độ phân giải render: YOLO resize ảnh về imgsz=1024 nên ảnh phát hiện bố cục chỉ cần độ phân giải thấp,
+# chỉ các vùng cần OCR mới được render lại ở độ phân giải cao
+LAYOUT_DPI = 100
+OCR_DPI = 300
+
+# Ngưỡng confidence khi predict và ngưỡng để giữ lại một box bố cục
+LAYOUT_CONF = 0.3
+BOX_SCORE_THRESHOLD = 0.4
+
+# Model riêng của từng tiến trình worker, được nạp một lần trong _init_pdf_worker
+_worker_model_detect_layout = None
+_worker_reader = None
 def summary_paragraph(client, paragraph):
     system_prompt = '''
             Bạn là chuyên giao trong việc tóm tắt ngắn gọn các văn bản lịch sử.
@@ -48,27 +67,154 @@ def extract_key_word(client, summary):
         )
     return response.choices[0].message.content
 
-def pdf_to_images(documents):
+# Prompt của summarize_and_extract_keyword, dùng chung với chế độ batch
+SUMMARY_KEYWORD_SYSTEM_PROMPT = '''
+            Bạn là chuyên gia trong việc tóm tắt và trích xuất từ khóa cho các văn bản lịch sử.
+            Với đoạn văn được cung cấp:
+            - summary: tóm tắt ngắn gọn đoạn văn nhưng tuyệt đối không được làm mất đi các thông tin lịch sử quan trọng.
+            - keyword: một từ/cụm từ khóa có thể thể hiện tổng quát nội dung cốt lõi của đoạn văn.
+            YÊU CẦU:
+            Chỉ trả về một JSON object có dạng {"summary": "...", "keyword": "..."}, không đưa thông tin gì thêm.
+            '''
+
+def _parse_summary_keyword(content):
+    """
+    Đọc JSON {"summary": ..., "keyword": ...} do LLM trả về.
+    Returns:
+        tuple (summary, keyword), hoặc None nếu JSON sai định dạng hoặc thiếu trường.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    summary = data.get('summary')
+    keyword = data.get('keyword')
+    if not isinstance(summary, str) or not isinstance(keyword, str) or not summary.strip() or not keyword.strip():
+        return None
+    return summary.strip(), keyword.strip()
+
+def summarize_and_extract_keyword(client, paragraph):
+    """
+    Tóm tắt và trích xuất từ khóa của một đoạn văn trong cùng một lần gọi LLM,
+    thay cho hai lần gọi summary_paragraph và extract_key_word.
+    Nếu JSON trả về sai định dạng thì gọi lại hai hàm riêng lẻ.
+
+    Returns:
+        tuple: (summary, keyword)
+    """
+    try:
+        response = client.chat.completions.create(
+                model='gpt-4o-mini',
+                temperature=0,
+                response_format={"type": "json_object"},
+
+            messages=[
+                {
+                    "role": "system",
+                    "content": SUMMARY_KEYWORD_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": paragraph
+                }
+                ]
+            )
+        parsed = _parse_summary_keyword(response.choices[0].message.content)
+    except Exception as e:
+        # Lỗi tạm thời (429/5xx) để LLMExecutor gọi lại, các lỗi khác thì dùng cách gọi riêng lẻ
+        if is_retryable_error(e):
+            raise
+        print(f"⚠️  Lỗi khi tóm tắt và tách từ khóa cùng lúc: {str(e)}")
+        parsed = None
+
+    if parsed is None:
+        print("⚠️  JSON tóm tắt/từ khóa không hợp lệ, gọi riêng từng bước")
+        return summary_paragraph(client, paragraph), extract_key_word(client, paragraph)
+    return parsed
+
+def pdf_to_images(documents, dpi=OCR_DPI):
     """
     Chuyển đổi từng trang của file PDF sang định dạng PIL Image.
+    Lưu ý: hàm giữ toàn bộ ảnh trong bộ nhớ, với file dài nên dùng iter_page_images.
     Args:
         documents (fitz.Document): Đối tượng PDF.
+        dpi (int): Độ phân giải khi render, mặc định OCR_DPI (300) như trước.
     Returns:
-        list: Một list các dictionary, mỗi dict chứa 'image' (PIL Image)
-              và 'page_number' của trang tương ứng.
-    """
-
-    doc_images = []
-    for page_index, page in enumerate(documents):
-        pix = page.get_pixmap(dpi=300)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        doc_images.append({
-            "image": img,
-            "page_index": page_index,
-            "page": page
-        })
+        list: Một list các dictionary, mỗi dict chứa 'image' (PIL Image), 'page_index', 'page'
+              và 'dpi' của trang tương ứng.
+    """
 
-    return doc_images
+    return list(iter_page_images(documents, dpi=dpi))
+
+def iter_page_images(documents, page_indices=None, dpi=LAYOUT_DPI, needs_render=None):
+    """
+    Generator render từng trang PDF thành PIL Image ngay khi cần dùng.
+    Mỗi ảnh chỉ được giữ cho đến khi nơi gọi lấy trang tiếp theo, nên bộ nhớ
+    đỉnh chỉ tương ứng với một trang bất kể độ dài tài liệu.
+    Args:
+        documents (fitz.Document): Đối tượng PDF.
+        page_indices (iterable): Các index trang cần render. None = toàn bộ trang.
+        dpi (int): Độ phân giải khi render.
+        needs_render (callable): Hàm nhận fitz.Page, trả về False nếu trang không cần render
+                                 (khi đó 'image' là None). None = render mọi trang.
+    Yields:
+        dict: Dictionary chứa 'image' (PIL Image hoặc None), 'page_index' và 'page'.
+    """
+    if page_indices is None:
+        page_indices = range(documents.page_count)
+    for page_index in page_indices:
+        page = documents[page_index]
+        if needs_render is not None and not needs_render(page):
+            yield {"image": None, "page_index": page_index, "page": page, "dpi": None}
+        else:
+            yield render_page_image(page, page_index, dpi=dpi)
+
+def render_page_image(page, page_index, dpi=LAYOUT_DPI):
+    """
+    Chuyển đổi một trang PDF sang PIL Image.
+    Args:
+        page (fitz.Page): Trang PDF.
+        page_index (int): Index của trang trong PDF.
+        dpi (int): Độ phân giải khi render.
+    Returns:
+        dict: Dictionary chứa 'image' (PIL Image), 'page_index', 'page' và 'dpi' của ảnh.
+    """
+    pix = page.get_pixmap(dpi=dpi)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return {
+        "image": img,
+        "page_index": page_index,
+        "page": page,
+        "dpi": dpi
+    }
+
+def image_bbox_to_pdf_rect(bbox, dpi):
+    """
+    Chuyển bounding box từ tọa độ ảnh (pixel, render ở `dpi`) sang tọa độ PDF (point, 72 point/inch).
+    Args:
+        bbox (list hoặc tuple): [x1, y1, x2, y2] theo tọa độ ảnh.
+        dpi (int): Độ phân giải của ảnh đã render.
+    Returns:
+        fitz.Rect: Vùng tương ứng trên trang PDF.
+    """
+    scale = dpi / 72
+    x1, y1, x2, y2 = [coord / scale for coord in bbox]
+    return fitz.Rect(x1, y1, x2, y2)
+
+def render_clip_for_ocr(page, clip_rect, dpi=OCR_DPI):
+    """
+    Render riêng một vùng của trang ở độ phân giải cao để OCR.
+    Args:
+        page (fitz.Page): Trang PDF.
+        clip_rect (fitz.Rect): Vùng cần render, theo tọa độ PDF.
+        dpi (int): Độ phân giải khi render.
+    Returns:
+        np.ndarray: Ảnh RGB của vùng đã render.
+    """
+    pix = page.get_pixmap(dpi=dpi, clip=clip_rect)
+    return np.array(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
 
 def detect_layout(model_detect_layout, pil_image_obj):
     """
@@ -83,12 +229,80 @@ def detect_layout(model_detect_layout, pil_image_obj):
     results = model_detect_layout.predict(
                   pil_image_obj,   # Image to predict
                   imgsz=1024,        # Prediction image size
-                  conf=0.3,          # Confidence threshold
+                  conf=LAYOUT_CONF,  # Confidence threshold
                   device="cpu"    # Device to use (e.g., 'cuda:0' or 'cpu')
               )
     return results[0]
 
 
+def detect_layout_batch(model_detect_layout, pil_images, batch_size=8):
+    """
+    Phát hiện bố cục cho nhiều trang, mỗi lần gọi predict xử lý tối đa batch_size ảnh.
+    Args:
+        model_detect_layout: Model Doclayout-yolo
+        pil_images (list): List các PIL Image của các trang.
+        batch_size (int): Số trang trong một lần gọi predict.
+    Returns:
+        list: List các ultralytics.engine.results.Results, theo đúng thứ tự pil_images.
+    """
+    all_results = []
+    for start in range(0, len(pil_images), batch_size):
+        results = model_detect_layout.predict(
+                      pil_images[start:start + batch_size],
+                      imgsz=1024,
+                      conf=LAYOUT_CONF,
+                      device="cpu",
+                      batch=batch_size
+                  )
+        all_results.extend(results)
+    return all_results
+
+def iter_layout_batches(documents, model_detect_layout, page_indices=None, batch_size=1, dpi=LAYOUT_DPI,
+                        needs_render=None):
+    """
+    Generator render các trang theo từng lô batch_size trang, phát hiện bố cục cho cả lô bằng một lần
+    gọi predict rồi trả lại từng trang theo thứ tự. Bộ nhớ đỉnh tương ứng với một lô trang.
+    Args:
+        documents (fitz.Document): Đối tượng PDF.
+        model_detect_layout: Model Doclayout-yolo
+        page_indices (iterable): Các index trang cần xử lý. None = toàn bộ trang.
+        batch_size (int): Số trang trong một lần gọi predict.
+        dpi (int): Độ phân giải khi render.
+        needs_render (callable): Xem iter_page_images.
+    Yields:
+        dict: Dữ liệu trang như iter_page_images, thêm 'layout_results' với các trang đã được render.
+    """
+    batch = []
+    for page_data in iter_page_images(documents, page_indices, dpi=dpi, needs_render=needs_render):
+        batch.append(page_data)
+        if len(batch) >= batch_size:
+            yield from _attach_layout_results(model_detect_layout, batch, batch_size)
+            batch = []
+    if batch:
+        yield from _attach_layout_results(model_detect_layout, batch, batch_size)
+
+def _attach_layout_results(model_detect_layout, batch, batch_size):
+    """
+    Chạy detect_layout_batch cho các trang có ảnh trong lô và gắn kết quả vào từng trang.
+    Nếu detect theo lô bị lỗi, các trang không có 'layout_results' và process_pdf_page sẽ detect lại
+    từng trang bên trong try của trang đó, nên chỉ trang lỗi bị bỏ qua.
+    """
+    rendered_pages = [page_data for page_data in batch if page_data["image"] is not None]
+    if rendered_pages:
+        start_time = time.time()
+        try:
+            layout_results = detect_layout_batch(model_detect_layout,
+                                                 [page_data["image"] for page_data in rendered_pages],
+                                                 batch_size)
+        except Exception as e:
+            print(f"❌ Lỗi khi phát hiện bố cục theo lô {len(rendered_pages)} trang, phát hiện lại từng trang: {str(e)}")
+            return batch
+        end_time = time.time()
+        print(f"⏱️  Thời gian phát hiện bố cục {len(rendered_pages)} trang: {end_time - start_time:.2f} giây")
+        for page_data, result in zip(rendered_pages, layout_results):
+            page_data["layout_results"] = result
+    return batch
+
 def recognize_text_from_image(reader, img_array_or_pil_image):
     """
     Thực hiện OCR trên một hình ảnh (NumPy array hoặc PIL Image) bằng EasyOCR.
@@ -101,7 +315,227 @@ def recognize_text_from_image(reader, img_array_or_pil_image):
     results = reader.readtext(img_array_or_pil_image, detail=0)
     return results
 
-def recognize_text_from_pymupdf_page(docs, page_index, bbox):
+def _group_images_for_batching(images, batch_size, max_padding_ratio=1.5):
+    """
+    Chia các ảnh thành các lô có hình dạng gần nhau: sắp theo tỉ lệ khung hình (theo nhóm log2) rồi theo chiều cao,
+    và chỉ thêm ảnh vào lô nếu ảnh đệm chung (chiều cao lớn nhất x chiều rộng lớn nhất) không lớn hơn
+    max_padding_ratio lần diện tích của ảnh nhỏ nhất trong lô. Nhờ vậy một dòng chữ dài và một vùng hẹp cao
+    không bị đệm thành một ảnh lớn hơn nhiều lần cả hai.
+    Returns:
+        list: List các list vị trí ảnh.
+    """
+    def sort_key(i):
+        height, width = images[i].shape[:2]
+        return round(np.log2(max(width, 1) / max(height, 1)) * 2), height, width
+
+    groups = []
+    current = []
+    max_height = max_width = 0
+    min_area = None
+    for i in sorted(range(len(images)), key=sort_key):
+        height, width = images[i].shape[:2]
+        area = max(height * width, 1)
+        if current:
+            new_max_height, new_max_width = max(max_height, height), max(max_width, width)
+            new_min_area = min(min_area, area)
+            if len(current) < batch_size and new_max_height * new_max_width <= max_padding_ratio * new_min_area:
+                current.append(i)
+                max_height, max_width, min_area = new_max_height, new_max_width, new_min_area
+                continue
+            groups.append(current)
+        current = [i]
+        max_height, max_width, min_area = height, width, area
+    if current:
+        groups.append(current)
+    return groups
+
+def recognize_text_from_images_batched(reader, images, batch_size=8, workers=0):
+    """
+    Thực hiện OCR theo lô trên nhiều vùng ảnh bằng EasyOCR (reader.readtext_batched).
+    Các ảnh được chia thành các lô có hình dạng gần nhau (_group_images_for_batching) rồi đệm nền trắng
+    về cùng kích thước trong mỗi lô (không resize nên không làm méo chữ), kết quả được trả về theo thứ tự ban đầu.
+    Args:
+        reader: easyocr.Reader
+        images (list): List các ảnh NumPy array (RGB).
+        batch_size (int): Số ảnh tối đa trong một lô.
+        workers (int): Số worker nạp dữ liệu của EasyOCR.
+    Returns:
+        list: List các list text, mỗi phần tử tương ứng với một ảnh đầu vào.
+    """
+    results = [[] for _ in images]
+    for chunk_ids in _group_images_for_batching(images, batch_size):
+        chunk = [images[i] for i in chunk_ids]
+        max_height = max(img.shape[0] for img in chunk)
+        max_width = max(img.shape[1] for img in chunk)
+        padded_chunk = []
+        for img in chunk:
+            canvas = np.full((max_height, max_width, 3), 255, dtype=np.uint8)
+            canvas[:img.shape[0], :img.shape[1]] = img
+            padded_chunk.append(canvas)
+
+        try:
+            chunk_texts = reader.readtext_batched(padded_chunk, batch_size=batch_size, workers=workers, detail=0)
+        except Exception as e:
+            # Nếu OCR theo lô lỗi, OCR lần lượt từng ảnh để không mất cả lô
+            print(f"      ❌ Lỗi khi OCR theo lô: {str(e)}")
+            chunk_texts = []
+            for img in chunk:
+                try:
+                    chunk_texts.append(recognize_text_from_image(reader, img))
+                except Exception as e:
+                    print(f"      ❌ Lỗi khi OCR: {str(e)}")
+                    chunk_texts.append([])
+
+        for i, texts in zip(chunk_ids, chunk_texts):
+            results[i] = texts
+    return results
+
+def normalize_block_text(text):
+    """
+    Chuẩn hóa text của một block PyMuPDF: đánh dấu cuối câu bằng '#' và nối các dòng.
+    """
+    text = text.replace('.\n','.#')
+    text = text.replace('\n',' ')
+    return text
+
+def has_usable_text_layer(page, min_chars=100, max_invalid_ratio=0.05):
+    """
+    Kiểm tra trang PDF có lớp text dùng được hay không (PDF gốc dạng số, không phải bản scan).
+    Args:
+        page (fitz.Page): Trang PDF.
+        min_chars (int): Số ký tự tối thiểu (không tính khoảng trắng) để coi là có text.
+        max_invalid_ratio (float): Tỷ lệ tối đa các ký tự lỗi font (U+FFFD, ký tự điều khiển).
+    Returns:
+        bool: True nếu có thể lấy text trực tiếp từ trang mà không cần YOLO và OCR.
+    """
+    text = page.get_text('text')
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < min_chars:
+        return False
+    invalid_chars = sum(1 for c in chars if c == '\ufffd' or not c.isprintable())
+    return invalid_chars / len(chars) <= max_invalid_ratio
+
+def _is_bold_span(span):
+    # Bit 4 (16) của flags là chữ đậm
+    return bool(span['flags'] & 16) or 'bold' in span.get('font', '').lower()
+
+def extract_paragraphs_from_text_layer(pdf_page_data, continue_index, margin_ratio=0.06,
+                                       title_size_ratio=1.15, title_max_words=30):
+    """
+    Tạo danh sách paragraph trực tiếp từ lớp text của trang (page.get_text('dict')),
+    thay cho YOLO + OCR với các trang PDF dạng số.
+    - Block nằm hoàn toàn trong lề trên/dưới (header, footer, số trang) được bỏ qua như nhãn 'abandon'.
+    - Block ngắn có cỡ chữ lớn hơn cỡ chữ thân bài hoặc toàn bộ in đậm được gán nhãn 'title'.
+    Args:
+        pdf_page_data (dict): Dictionary chứa 'page' (fitz.Page) và 'page_index'.
+        continue_index (int): Index tiếp tục từ lần xử lý trước
+        margin_ratio (float): Tỷ lệ chiều cao trang được coi là lề trên/dưới.
+        title_size_ratio (float): Tỷ lệ cỡ chữ so với thân bài để coi là tiêu đề.
+        title_max_words (int): Số từ tối đa của một tiêu đề.
+    Returns:
+        tuple: (continue_index, processed_paragraphs)
+    """
+    page = pdf_page_data["page"]
+    page_index = pdf_page_data["page_index"]
+    print(f"\n--- Xử lý trang (lớp text): {page_index} ---")
+
+    page_height = page.rect.height
+    top_margin = page.rect.y0 + page_height * margin_ratio
+    bottom_margin = page.rect.y1 - page_height * margin_ratio
+
+    text_blocks = [block for block in page.get_text('dict')['blocks'] if block.get('type') == 0]
+
+    # Cỡ chữ thân bài = cỡ chữ chiếm nhiều ký tự nhất trên trang
+    size_weights = {}
+    for block in text_blocks:
+        for line in block['lines']:
+            for span in line['spans']:
+                size = round(span['size'], 1)
+                size_weights[size] = size_weights.get(size, 0) + len(span['text'].strip())
+    body_size = max(size_weights, key=size_weights.get) if size_weights else 0
+
+    processed_paragraphs = []
+    for block in text_blocks:
+        x0, y0, x1, y1 = block['bbox']
+        # Bỏ qua header/footer giống nhãn 'abandon' của model layout
+        if y1 <= top_margin or y0 >= bottom_margin:
+            continue
+
+        spans = [span for line in block['lines'] for span in line['spans'] if span['text'].strip()]
+        if not spans:
+            continue
+
+        raw_text = ''.join(''.join(span['text'] for span in line['spans']) + '\n' for line in block['lines'])
+        text = normalize_block_text(raw_text).strip()
+        if not text:
+            continue
+
+        max_size = max(span['size'] for span in spans)
+        is_short = len(text.split()) <= title_max_words
+        is_title = is_short and (max_size >= body_size * title_size_ratio or all(_is_bold_span(span) for span in spans))
+        label = 'title' if is_title else 'plain text'
+
+        continue_index += 1
+        processed_paragraphs.append({
+            'type': label,
+            'full_text': text,
+            'page_index': page_index,
+            'parent_index': -1,
+            'index': continue_index,
+            'is_title': is_title
+        })
+
+    print(f"\n  >>> Hoàn thành xử lý trang {page_index}: {len(processed_paragraphs)} paragraphs")
+    return continue_index, processed_paragraphs
+
+class PageTextIndex:
+    """
+    Chỉ mục không gian cho các từ trong lớp text của một trang PDF.
+    Lớp text chỉ được phân tích một lần (page.get_text('words')); các từ được sắp theo tọa độ y của tâm
+    nên mỗi vùng cần tra cứu chỉ cần tìm nhị phân trên trục y rồi lọc theo trục x.
+    """
+
+    def __init__(self, page):
+        words = page.get_text('words')
+        # Sắp theo tâm y để tra cứu nhị phân
+        entries = sorted(
+            (((w[1] + w[3]) / 2, (w[0] + w[2]) / 2, w[5], w[6], w[7], w[4]) for w in words),
+            key=lambda entry: entry[0]
+        )
+        self.center_ys = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def lookup(self, clip_rect):
+        """
+        Lấy text của các từ có tâm nằm trong clip_rect, ghép theo thứ tự đọc (block, dòng, từ)
+        và chuẩn hóa như normalize_block_text.
+        Args:
+            clip_rect (fitz.Rect): Vùng cần lấy text, theo tọa độ PDF.
+        Returns:
+            str: Text trong vùng, chuỗi rỗng nếu không có từ nào.
+        """
+        start = bisect_left(self.center_ys, clip_rect.y0)
+        end = bisect_right(self.center_ys, clip_rect.y1)
+        selected = sorted(
+            (block_no, line_no, word_no, text)
+            for _, center_x, block_no, line_no, word_no, text in self.entries[start:end]
+            if clip_rect.x0 <= center_x <= clip_rect.x1
+        )
+        if not selected:
+            return ""
+
+        # Ghép các từ cùng dòng bằng khoảng trắng, mỗi dòng kết thúc bằng '\n' như get_text('blocks')
+        lines = []
+        current_line = None
+        for block_no, line_no, _, text in selected:
+            if (block_no, line_no) != current_line:
+                lines.append([])
+                current_line = (block_no, line_no)
+            lines[-1].append(text)
+        raw_text = ''.join(' '.join(line_words) + '\n' for line_words in lines)
+        return normalize_block_text(raw_text)
+
+def recognize_text_from_pymupdf_page(docs, page_index, bbox, dpi=OCR_DPI, text_index=None):
     """
     Trích xuất văn bản từ một trang PyMuPDF trong một vùng (bounding box) nhất định.
 
@@ -109,52 +543,53 @@ def recognize_text_from_pymupdf_page(docs, page_index, bbox):
         docs (fitz.Document): Đối tượng PDF.
         page_index (int): Index của trang trong PDF.
         bbox (list hoặc tuple): Bounding box dưới dạng [x1, y1, x2, y2], đây là tọa độ hình ảnh
+        dpi (int): Độ phân giải của ảnh chứa bbox.
+        text_index (PageTextIndex): Chỉ mục text đã dựng sẵn cho trang, nên truyền vào khi
+                                    tra cứu nhiều box trên cùng một trang.
 
     Returns:
         str: Văn bản được trích xuất từ vùng đã cho. Trả về chuỗi rỗng nếu không tìm thấy text.
     """
     try:
 
-        # chuyển sang tọa độ hình ảnh sang tọa độ PDF
-        # 300 DPI = 300/72 = 4.167 pixels per point
-
-        scale = 300/72
-        # Tạo một fitz.Rect từ bounding box
-        x1, y1, x2, y2 = [coord / scale for coord in bbox]
-
-        # Tạo clip rect và trích xuất text
-        clip_rect = fitz.Rect(x1, y1, x2, y2)
-        pymupdf_page = docs[page_index]
-        block = pymupdf_page.get_text('blocks',clip= clip_rect)
+        # Tạo clip rect theo tọa độ PDF và tra cứu text trong chỉ mục của trang
+        clip_rect = image_bbox_to_pdf_rect(bbox, dpi)
+        if text_index is None:
+            text_index = PageTextIndex(docs[page_index])
 
-        text = block[0][4]
-        text = text.replace('.\n','.#')
-        text = text.replace('\n',' ')
-
-        return  text
+        return text_index.lookup(clip_rect)
 
     except Exception as e:
         print(f"  ❌ Lỗi khi trích xuất text từ PyMuPDF: {str(e)}")
         return "" # Trả về chuỗi rỗng nếu có lỗi
 
 
-def process_pdf_page(docs, model_detect_layout,reader, pdf_page_data, continue_index):
+def process_pdf_page(docs, model_detect_layout,reader, pdf_page_data, continue_index, ocr_dpi=OCR_DPI,
+                     ocr_batch_size=8, ocr_workers=0):
     """
     Xử lý một trang PDF: phát hiện bố cục và nhận dạng văn bản.
+    Các box không lấy được text từ PyMuPDF được gom lại và OCR theo lô một lần cho cả trang.
     Args:
         model_detect_layout: model Doclayout_yolo
-        pdf_page_data (dict): Dictionary chứa 'image' (PIL Image) và 'page_index'.
+        pdf_page_data (dict): Dictionary chứa 'image' (PIL Image), 'page_index', 'page' và 'dpi'.
+                              Nếu có 'layout_results' (đã detect theo lô) thì không detect lại.
         continue_index (int): Index tiếp tục từ lần xử lý trước
+        ocr_dpi (int): Độ phân giải khi render vùng cần OCR.
+        ocr_batch_size (int): Số vùng ảnh trong một lô OCR.
+        ocr_workers (int): Số worker nạp dữ liệu của EasyOCR.
     Returns:
         tuple: (continue_index, processed_paragraphs, page_results)
     """
     page_index = pdf_page_data["page_index"]
     pil_image = pdf_page_data["image"]
+    image_dpi = pdf_page_data.get("dpi", OCR_DPI)
 
     print(f"\n--- Xử lý trang: {page_index} ---")
 
     # 1. Phát hiện bố cục
-    layout_results = detect_layout(model_detect_layout, pil_image)
+    layout_results = pdf_page_data.get("layout_results")
+    if layout_results is None:
+        layout_results = detect_layout(model_detect_layout, pil_image)
     processed_paragraphs = []
 
     # Kiểm tra xem có boxes không
@@ -162,148 +597,461 @@ def process_pdf_page(docs, model_detect_layout,reader, pdf_page_data, continue_i
         print("    Không tìm thấy đối tượng bố cục nào.")
         return continue_index, processed_paragraphs
 
-    # 2. Xử lý từng box
+    # Phân tích lớp text của trang một lần cho tất cả các box
+    text_index = PageTextIndex(docs[page_index])
+
+    # 2. Lấy text của từng box từ PyMuPDF, các box chưa có text được đưa vào hàng đợi OCR
+    slots = []  # Mỗi slot: [label, text]
+    ocr_slot_ids = []
+    ocr_images = []
     for i, box in enumerate(layout_results.boxes):
         bbox = box.xyxy[0].tolist()
-        x1, y1, x2, y2 = map(int, bbox)
         label = model_detect_layout.names[int(box.cls[0])]
         score = box.conf[0].item()
         # Chỉ xử lý box không phải abandon
         if label == 'abandon':
             continue
         # Chỉ xử lý box có confidence >= threshold
-        if score < 0.4:
+        if score < BOX_SCORE_THRESHOLD:
             continue
 
-        continue_index += 1
-
         try:
-            # Cắt ảnh theo bbox
-            image_cut = pil_image.crop((x1, y1, x2, y2))
-            img_np = np.array(image_cut)
-
-            # 4. Nhận dạng văn bản
             start_time = time.time()
-            recognized_text_results = recognize_text_from_pymupdf_page(docs, page_index, bbox)
+            recognized_text_results = recognize_text_from_pymupdf_page(docs, page_index, bbox, dpi=image_dpi,
+                                                                       text_index=text_index)
             end_time = time.time()
             print(f"      ⏱️  Thời gian trích text: {end_time - start_time:.2f} giây")
             if recognized_text_results == "":
-                recognized_text_results = recognize_text_from_image(reader, img_np)
-                recognized_text_results = ' '.join(recognized_text_results)
+                # Chỉ render vùng bbox ở độ phân giải cao khi thực sự cần OCR
+                clip_rect = image_bbox_to_pdf_rect(bbox, image_dpi)
+                ocr_images.append(render_clip_for_ocr(docs[page_index], clip_rect, dpi=ocr_dpi))
+                ocr_slot_ids.append(len(slots))
+            slots.append([label, recognized_text_results])
+
+        except Exception as e:
+            print(f"      ❌ Lỗi khi xử lý box: {str(e)}")
+
+    # 3. OCR theo lô tất cả các vùng chưa có text rồi trả kết quả về đúng slot
+    if ocr_images:
+        start_time = time.time()
+        ocr_texts = recognize_text_from_images_batched(reader, ocr_images, batch_size=ocr_batch_size,
+                                                       workers=ocr_workers)
+        end_time = time.time()
+        print(f"      ⏱️  Thời gian OCR {len(ocr_images)} vùng: {end_time - start_time:.2f} giây")
+        for slot_id, texts in zip(ocr_slot_ids, ocr_texts):
+            slots[slot_id][1] = ' '.join(texts)
+
+    # 4. Tạo thông tin paragraph theo thứ tự box, bỏ qua box không nhận dạng được text
+    for label, recognized_text_results in slots:
+        if recognized_text_results:
             print(f"      ✅ Nhận dạng được {recognized_text_results} text")
-            # 5. Tạo thông tin paragraph
-            if recognized_text_results:
-                paragraph_info = {
-                    'type': label,
-                    'full_text': recognized_text_results,
-                    'page_index': page_index,
-                    'parent_index': -1,
-                    'index': continue_index,
-                    'is_title': label == 'title'
-                }
+            continue_index += 1
+            paragraph_info = {
+                'type': label,
+                'full_text': recognized_text_results,
+                'page_index': page_index,
+                'parent_index': -1,
+                'index': continue_index,
+                'is_title': label == 'title'
+            }
 
-                processed_paragraphs.append(paragraph_info)
+            processed_paragraphs.append(paragraph_info)
 
-            else:
-                print(f"      ⚠ Không nhận dạng được text")
-                continue_index -= 1  # Rollback index nếu không nhận dạng được
+        else:
+            print(f"      ⚠ Không nhận dạng được text")
 
-        except Exception as e:
-            print(f"      ❌ Lỗi khi xử lý box: {str(e)}")
-            continue_index -= 1  # Rollback index nếu có lỗi
-    e_time = time.time()
     print(f"\n  >>> Hoàn thành xử lý trang {page_index}: {len(processed_paragraphs)} paragraphs")
     return continue_index, processed_paragraphs
 
 
-def process_full_pdf(model_detect_layout, reader, pdf_path):
+def process_page(docs, model_detect_layout, reader, pdf_page_data, continue_index, ocr_dpi=OCR_DPI,
+                 ocr_batch_size=8, ocr_workers=0):
+    """
+    Xử lý một trang theo cách phù hợp: lấy trực tiếp từ lớp text nếu trang không được render
+    (PDF dạng số), ngược lại phát hiện bố cục bằng YOLO và OCR khi cần.
+    Returns:
+        tuple: (continue_index, processed_paragraphs)
+    """
+    if pdf_page_data["image"] is None:
+        return extract_paragraphs_from_text_layer(pdf_page_data, continue_index)
+    return process_pdf_page(docs, model_detect_layout, reader, pdf_page_data, continue_index, ocr_dpi=ocr_dpi,
+                            ocr_batch_size=ocr_batch_size, ocr_workers=ocr_workers)
+
+def _page_needs_render(use_text_layer):
+    """Trả về hàm needs_render cho iter_page_images."""
+    if not use_text_layer:
+        return None
+    return lambda page: not has_usable_text_layer(page)
+
+def extraction_settings(use_text_layer=True, layout_batch_size=1, layout_dpi=LAYOUT_DPI, ocr_dpi=OCR_DPI,
+                        ocr_batch_size=8, ocr_languages=('vi', 'en'), **_):
+    """
+    Các tham số làm thay đổi kết quả trích xuất, dùng trong khóa của PDFExtractionCache và IngestionCheckpoint.
+    Nhận được cả dict tham số của process_full_pdf (các tham số khác như num_workers, cache bị bỏ qua).
+    """
+    return {
+        'use_text_layer': use_text_layer,
+        'layout_batch_size': layout_batch_size,
+        'layout_dpi': layout_dpi,
+        'ocr_dpi': ocr_dpi,
+        'ocr_batch_size': ocr_batch_size,
+        'layout_conf': LAYOUT_CONF,
+        'box_score_threshold': BOX_SCORE_THRESHOLD,
+        'ocr_languages': list(ocr_languages),
+    }
+
+def process_full_pdf(model_detect_layout, reader, pdf_path, num_workers=1, layout_model_path=None,
+                     ocr_languages=('vi', 'en'), mp_context=None, use_text_layer=True, layout_batch_size=1,
+                     layout_dpi=LAYOUT_DPI, ocr_dpi=OCR_DPI, ocr_batch_size=8, ocr_workers=0, cache=None,
+                     checkpoint=None, merge_n_word=None):
     """
     Xử lý toàn bộ file PDF: chuyển đổi, phát hiện bố cục và nhận dạng văn bản từng trang.
     Args:
         pdf_path (str): Đường dẫn đến file PDF.
+        num_workers (int): Số tiến trình xử lý song song. Với num_workers > 1, mỗi worker tự mở file PDF,
+                           tự nạp model layout (từ layout_model_path) và EasyOCR, rồi xử lý một nhóm trang.
+        layout_model_path (str): Đường dẫn file model Doclayout-yolo, bắt buộc khi num_workers > 1.
+        ocr_languages (tuple): Ngôn ngữ cho easyocr.Reader trong các worker.
+        mp_context (str): Phương thức khởi tạo tiến trình ('fork', 'spawn', 'forkserver').
+                          None = mặc định của hệ điều hành ('fork' trên Linux). Trong tiến trình đã có thread
+                          hoặc kết nối (ví dụ server Flask) phải dùng 'spawn': worker chỉ cần đường dẫn model
+                          và tự nạp model trong _init_pdf_worker, không thừa hưởng trạng thái của tiến trình cha.
+        use_text_layer (bool): Lấy text trực tiếp từ lớp text của các trang PDF dạng số, chỉ dùng
+                               YOLO + EasyOCR cho các trang scan.
+        layout_batch_size (int): Số trang được phát hiện bố cục trong một lần gọi predict.
+        layout_dpi (int): Độ phân giải render trang để phát hiện bố cục.
+        ocr_dpi (int): Độ phân giải render các vùng cần OCR.
+        ocr_batch_size (int): Số vùng ảnh trong một lô OCR của EasyOCR.
+        ocr_workers (int): Số worker nạp dữ liệu của EasyOCR.
+        cache (PDFExtractionCache): Cache kết quả theo nội dung file PDF. Nếu file đã được xử lý với
+                                    cùng model và tham số, kết quả được trả về ngay mà không render, YOLO hay OCR.
+        checkpoint (IngestionCheckpoint): Lưu paragraphs của từng trang đã xong; lần chạy lại sẽ chỉ xử lý
+                                          các trang còn thiếu.
+        merge_n_word (int): Nếu có, kết quả có thêm "merged_paragraphs" (xem merge_short_paragraphs).
+                            Ở chế độ tuần tự, các đoạn được gộp ngay khi từng trang được trích xuất xong.
     Returns:
-        dict: Dictionary chứa tất cả kết quả xử lý và thống kê
+        dict: Dictionary chứa tất cả kết quả xử lý và thống kê. "failed_pages" là index các trang bị lỗi
+              (bị bỏ qua); kết quả có trang lỗi không được lưu vào cache.
     """
-    print(f"\n🚀 Bắt đầu xử lý PDF: {pdf_path}")
-    documents = fitz.open(pdf_path)
-    # Chuyển đổi PDF thành ảnh
-    start_time = time.time()
-    all_page_images = pdf_to_images(documents)
-    end_time = time.time()
-    total_pages = len(all_page_images)
-    print(f"📄 Tổng số trang: {total_pages}")
-    print(f"⏱️  Thời gian chuyển đổi: {end_time - start_time:.2f} giây")
-    # Khởi tạo kết quả
+    page_options = {
+        'use_text_layer': use_text_layer,
+        'layout_batch_size': layout_batch_size,
+        'layout_dpi': layout_dpi,
+        'ocr_dpi': ocr_dpi,
+        'ocr_batch_size': ocr_batch_size,
+        'ocr_workers': ocr_workers,
+    }
+    if cache is not None:
+        # Các tham số làm thay đổi kết quả trích xuất đều nằm trong khóa cache
+        settings = extraction_settings(ocr_languages=ocr_languages, **page_options)
+        cache_key, model_fingerprint = cache.make_key(pdf_path, layout_model_path, settings)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            print(f"⚡ Dùng kết quả đã cache cho PDF: {pdf_path}")
+            return _with_merged_paragraphs(dict(cached_result, pdf_path=pdf_path), merge_n_word)
+
+    if num_workers > 1:
+        if layout_model_path is None:
+            raise ValueError("Cần layout_model_path để các worker tự nạp model khi num_workers > 1")
+        result = _process_full_pdf_parallel(pdf_path, num_workers, layout_model_path, ocr_languages, mp_context,
+                                            page_options, checkpoint)
+    else:
+        result = _process_full_pdf_sequential(model_detect_layout, reader, pdf_path, page_options, checkpoint,
+                                              merge_n_word)
+
+    if cache is not None:
+        if result["failed_pages"]:
+            # Kết quả thiếu trang không được cache, lần upload sau sẽ xử lý lại các trang lỗi
+            print(f"⚠️  Không cache kết quả vì {len(result['failed_pages'])} trang bị lỗi: "
+                  f"{[page_index + 1 for page_index in result['failed_pages']]}")
+        else:
+            cache.put(cache_key, {key: value for key, value in result.items() if key != 'merged_paragraphs'},
+                      model_fingerprint)
+    return _with_merged_paragraphs(result, merge_n_word)
+
+def _with_merged_paragraphs(result, merge_n_word):
+    """Thêm "merged_paragraphs" cho kết quả chưa được gộp trong lúc trích xuất (cache, chế độ song song)."""
+    if merge_n_word is not None and 'merged_paragraphs' not in result:
+        result["merged_paragraphs"] = merge_short_paragraphs(result["all_paragraphs"], n_word=merge_n_word)
+    return result
 
+def _process_full_pdf_sequential(model_detect_layout, reader, pdf_path, page_options, checkpoint=None,
+                                 merge_n_word=None):
+    """
+    Xử lý tuần tự từng trang của file PDF trong tiến trình hiện tại.
+    Nếu có merge_n_word, các paragraph được đưa thẳng từ iter_pdf_paragraphs vào iter_merged_paragraphs
+    nên việc gộp đoạn diễn ra cùng lúc với việc trích xuất, không cần duyệt lại danh sách sau đó.
+    """
+    print(f"\n🚀 Bắt đầu xử lý PDF: {pdf_path}")
     all_paragraphs = []
+    failed_pages = []
+
+    def collect(paragraphs):
+        for paragraph in paragraphs:
+            all_paragraphs.append(paragraph)
+            yield paragraph
+
+    with fitz.open(pdf_path) as documents:
+        total_pages = documents.page_count
+        print(f"📄 Tổng số trang: {total_pages}")
+        paragraphs = collect(iter_pdf_paragraphs(documents, model_detect_layout, reader, checkpoint=checkpoint,
+                                                 failed_pages=failed_pages, **page_options))
+        if merge_n_word is not None:
+            merged_paragraphs = list(iter_merged_paragraphs(paragraphs, n_word=merge_n_word))
+        else:
+            for _ in paragraphs:
+                pass
+
+    # Tạo thống kê tổng quan
+    result = {
+        "pdf_path": pdf_path,
+        "total_pages": total_pages,
+        "total_paragraphs": len(all_paragraphs),
+        "all_paragraphs": all_paragraphs,
+        "failed_pages": sorted(failed_pages),
+    }
+    if merge_n_word is not None:
+        result["merged_paragraphs"] = merged_paragraphs
+    return result
+
+def iter_pdf_paragraphs(documents, model_detect_layout, reader, checkpoint=None, failed_pages=None, **page_options):
+    """
+    Trích xuất tuần tự các paragraph của tài liệu và trả về từng paragraph ngay khi trang chứa nó xử lý xong,
+    theo thứ tự trang và với index liên tục như process_full_pdf. Có thể đưa thẳng vào iter_merged_paragraphs
+    để gộp đoạn song song với việc trích xuất:
+        merged = merge_short_paragraphs(iter_pdf_paragraphs(documents, model, reader))
+
+    Args:
+        documents: Tài liệu fitz đã mở, phải còn mở trong suốt quá trình duyệt.
+        checkpoint (IngestionCheckpoint): Trang đã có trong checkpoint được dùng lại, trang mới được lưu vào.
+        failed_pages (list): Nếu có, index các trang bị lỗi (bị bỏ qua) được thêm vào list này.
+        **page_options: Các tham số của _process_page_range (use_text_layer, layout_batch_size, ...).
+
+    Yields:
+        dict: Paragraph.
+    """
+    done_results, remaining_pages = _resume_from_checkpoint(checkpoint, documents.page_count)
+    new_results = _iter_page_range(documents, model_detect_layout, reader, remaining_pages,
+                                   checkpoint=checkpoint, failed_pages=failed_pages, **page_options)
+    # Cả hai nguồn đều theo thứ tự trang, heapq.merge ghép chúng mà không phải chờ xử lý hết các trang
+    page_results = heapq.merge(sorted(done_results, key=lambda result: result[0]), new_results,
+                               key=lambda result: result[0])
     continue_index = 0
+    for _, page_paragraphs in page_results:
+        for paragraph in page_paragraphs:
+            continue_index += 1
+            paragraph['index'] = continue_index
+            yield paragraph
+
+def _resume_from_checkpoint(checkpoint, total_pages):
+    """
+    Lấy kết quả các trang đã xử lý xong từ checkpoint.
+    Returns:
+        tuple: (page_results đã có, list index các trang còn phải xử lý)
+    """
+    if checkpoint is None:
+        return [], list(range(total_pages))
+    done_pages = checkpoint.load_pages()
+    if done_pages:
+        print(f"♻️  Tiếp tục từ checkpoint: {len(done_pages)}/{total_pages} trang đã xử lý xong")
+    page_results = list(done_pages.items())
+    remaining_pages = [page_index for page_index in range(total_pages) if page_index not in done_pages]
+    return page_results, remaining_pages
+
+def _init_pdf_worker(layout_model_path, ocr_languages):
+    """
+    Khởi tạo một tiến trình worker: nạp model layout và EasyOCR đúng một lần cho mỗi tiến trình.
+    """
+    global _worker_model_detect_layout, _worker_reader
+    import torch
+    from doclayout_yolo import YOLOv10
+    import easyocr
+
+    # Mỗi worker chỉ dùng 1 luồng để số tiến trình tương ứng với số core CPU
+    torch.set_num_threads(1)
+    _worker_model_detect_layout = YOLOv10(layout_model_path)
+    _worker_reader = easyocr.Reader(list(ocr_languages), gpu=False)
+
+def _process_pdf_shard(pdf_path, page_indices, page_options):
+    """
+    Xử lý một nhóm trang trong tiến trình worker. Worker tự mở file PDF.
+    Returns:
+        tuple: (list các tuple (page_index, page_paragraphs), list index các trang bị lỗi)
+    """
+    documents = fitz.open(pdf_path)
+    try:
+        return _process_page_range(documents, _worker_model_detect_layout, _worker_reader, page_indices,
+                                   **page_options)
+    finally:
+        documents.close()
 
-    # Xử lý từng trang
-    for i, page_data in enumerate(all_page_images, 1):
-        print(f"\n📖 Đang xử lý trang {i}/{total_pages}...")
+def _process_page_range(documents, model_detect_layout, reader, page_indices, use_text_layer=True,
+                        layout_batch_size=1, layout_dpi=LAYOUT_DPI, ocr_dpi=OCR_DPI, ocr_batch_size=8,
+                        ocr_workers=0):
+    """
+    Xử lý tuần tự các trang trong page_indices. Index của paragraph trong từng trang được đánh
+    tạm thời từ 0, nơi gọi sẽ đánh lại index theo thứ tự trang bằng _renumber_paragraphs.
+    Trang bị lỗi không có trong kết quả để lần chạy lại xử lý lại.
+    Returns:
+        tuple: (list các tuple (page_index, page_paragraphs), list index các trang bị lỗi)
+    """
+    failed_pages = []
+    page_results = list(_iter_page_range(documents, model_detect_layout, reader, page_indices, use_text_layer,
+                                         layout_batch_size, layout_dpi, ocr_dpi, ocr_batch_size, ocr_workers,
+                                         failed_pages=failed_pages))
+    return page_results, failed_pages
 
+def _iter_page_range(documents, model_detect_layout, reader, page_indices, use_text_layer=True,
+                     layout_batch_size=1, layout_dpi=LAYOUT_DPI, ocr_dpi=OCR_DPI, ocr_batch_size=8,
+                     ocr_workers=0, checkpoint=None, failed_pages=None):
+    """
+    Bản generator của _process_page_range: trả về (page_index, page_paragraphs) ngay khi mỗi trang xử lý xong.
+    Index của các trang bị lỗi được thêm vào failed_pages (nếu có).
+    """
+    total_pages = documents.page_count
+    # Render và phát hiện bố cục theo từng lô trang, ảnh của lô trước được giải phóng khi sang lô mới
+    page_iterator = iter_layout_batches(documents, model_detect_layout, page_indices, batch_size=layout_batch_size,
+                                        dpi=layout_dpi, needs_render=_page_needs_render(use_text_layer))
+    for page_data in page_iterator:
+        page_index = page_data["page_index"]
+        print(f"\n📖 Đang xử lý trang {page_index + 1}/{total_pages}...")
         try:
-            # Xử lý trang và nhận kết quả
             start_time = time.time()
-            continue_index, page_paragraphs = process_pdf_page(documents, model_detect_layout,reader, page_data, continue_index)
+            _, page_paragraphs = process_page(documents, model_detect_layout, reader, page_data, 0, ocr_dpi=ocr_dpi,
+                                              ocr_batch_size=ocr_batch_size, ocr_workers=ocr_workers)
             end_time = time.time()
-            print(f"⏱️  Thời gian detect và trích text trang {i}: {end_time - start_time:.2f} giây")
-            # Thêm paragraphs vào danh sách tổng
-            all_paragraphs.extend(page_paragraphs)
+            print(f"⏱️  Thời gian detect và trích text trang {page_index + 1}: {end_time - start_time:.2f} giây")
+        except Exception as e:
+            print(f"❌ Lỗi khi xử lý trang {page_index + 1}: {str(e)}")
+            if failed_pages is not None:
+                failed_pages.append(page_index)
+            continue
 
-            print(f"✅ Hoàn thành trang {i}: {len(page_paragraphs)} paragraphs")
+        if checkpoint is not None:
+            checkpoint.save_page(page_index, page_paragraphs)
+        print(f"✅ Hoàn thành trang {page_index + 1}: {len(page_paragraphs)} paragraphs")
+        yield page_index, page_paragraphs
 
-        except Exception as e:
-            print(f"❌ Lỗi khi xử lý trang {i}: {str(e)}")
+def _renumber_paragraphs(page_results):
+    """
+    Ghép paragraphs của các trang theo thứ tự trang và đánh lại index liên tục như chế độ tuần tự.
+    Returns:
+        list: all_paragraphs
+    """
+    all_paragraphs = []
+    continue_index = 0
+    for _, page_paragraphs in sorted(page_results, key=lambda result: result[0]):
+        for paragraph in page_paragraphs:
+            continue_index += 1
+            paragraph['index'] = continue_index
+            all_paragraphs.append(paragraph)
+    return all_paragraphs
 
+def _split_page_shards(page_indices, num_workers, shards_per_worker=4):
+    """
+    Chia các trang thành các nhóm trang liên tiếp. Mỗi worker nhận vài nhóm nhỏ
+    để cân bằng tải khi thời gian xử lý các trang chênh lệch nhau.
+    """
+    num_shards = max(1, min(len(page_indices), num_workers * shards_per_worker))
+    shard_size = max(1, -(-len(page_indices) // num_shards))
+    return [page_indices[start:start + shard_size] for start in range(0, len(page_indices), shard_size)]
 
-    # Tạo thống kê tổng quan
-    total_paragraphs = len(all_paragraphs)
+def _process_full_pdf_parallel(pdf_path, num_workers, layout_model_path, ocr_languages, mp_context=None,
+                               page_options=None, checkpoint=None):
+    """
+    Xử lý file PDF bằng một process pool, mỗi worker xử lý một nhóm trang.
+    Tiến trình cha lưu checkpoint khi từng nhóm trang hoàn thành.
+    """
+    print(f"\n🚀 Bắt đầu xử lý PDF với {num_workers} tiến trình: {pdf_path}")
+    with fitz.open(pdf_path) as documents:
+        total_pages = documents.page_count
+    print(f"📄 Tổng số trang: {total_pages}")
+
+    page_results, remaining_pages = _resume_from_checkpoint(checkpoint, total_pages)
+    shards = _split_page_shards(remaining_pages, num_workers)
+    context = multiprocessing.get_context(mp_context) if mp_context else None
+
+    start_time = time.time()
+    first_error = None
+    failed_pages = []
+    if shards:
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=context,
+                                 initializer=_init_pdf_worker,
+                                 initargs=(layout_model_path, tuple(ocr_languages))) as executor:
+            futures = [executor.submit(_process_pdf_shard, pdf_path, shard, page_options or {}) for shard in shards]
+            for future in as_completed(futures):
+                try:
+                    shard_results, shard_failed_pages = future.result()
+                except Exception as e:
+                    # Vẫn chờ và lưu các nhóm trang khác trước khi báo lỗi
+                    print(f"❌ Lỗi khi xử lý nhóm trang: {str(e)}")
+                    first_error = first_error or e
+                    continue
+                if checkpoint is not None:
+                    for page_index, page_paragraphs in shard_results:
+                        checkpoint.save_page(page_index, page_paragraphs)
+                page_results.extend(shard_results)
+                failed_pages.extend(shard_failed_pages)
+    if first_error is not None:
+        raise first_error
+    end_time = time.time()
+    print(f"⏱️  Thời gian detect và trích text {total_pages} trang: {end_time - start_time:.2f} giây")
+
+    all_paragraphs = _renumber_paragraphs(page_results)
     return {
         "pdf_path": pdf_path,
         "total_pages": total_pages,
-        "total_paragraphs": total_paragraphs,
+        "total_paragraphs": len(all_paragraphs),
         "all_paragraphs": all_paragraphs,
+        "failed_pages": sorted(failed_pages),
     }
 
-def merge_short_paragraphs(pdf_result_all_paragraphs, n_word=200):
+def iter_merged_paragraphs(paragraphs, n_word=200):
     """
-    Gộp các đoạn văn bản ngắn (dưới n_word từ) với đoạn văn bản kế tiếp nó.
-    Hàm sẽ thay đổi trực tiếp list đầu vào và giảm số lượng phần tử.
+    Gộp các đoạn văn bản ngắn (dưới n_word từ) với các đoạn kế tiếp trong một lần duyệt.
+    Nhận bất kỳ iterable nào (ví dụ generator iter_pdf_paragraphs) nên có thể gộp ngay trong lúc
+    các trang còn đang được trích xuất. Dict đầu vào không bị thay đổi, mỗi đoạn trả về là một dict mới.
 
     Args:
-        pdf_result_all_paragraphs (list): List các dictionary, mỗi dictionary là một đoạn.
-                                          Mỗi dict phải có key 'full_text'.
-        n_word (int): Ngưỡng số từ. Nếu đoạn có ít hơn n_word từ, nó sẽ được gộp.
+        paragraphs (iterable): Các dictionary, mỗi dictionary là một đoạn, có key 'full_text'.
+        n_word (int): Ngưỡng số từ. Nếu đoạn có ít hơn n_word từ, nó sẽ được gộp với đoạn kế tiếp.
 
-    Returns:
-        list: List đã được gộp. Đây cũng chính là list đã được sửa đổi từ đầu vào.
+    Yields:
+        dict: Đoạn đã gộp, giữ các key khác của đoạn đầu tiên trong nhóm.
     """
-    # Tạo một bản sao để không làm thay đổi list gốc bên ngoài hàm nếu không muốn
-    paragraphs = list(pdf_result_all_paragraphs)
-    i = 0
-    # Dùng 'while' vì độ dài của list sẽ thay đổi trong quá trình lặp
-    while i < len(paragraphs) - 1:
-        current_paragraph = paragraphs[i]
+    first_paragraph = None
+    text_parts = []
+    word_count = 0
+    for paragraph in paragraphs:
+        text = paragraph.get('full_text', '')
+        if first_paragraph is not None and word_count >= n_word:
+            yield dict(first_paragraph, full_text=" ".join(text_parts))
+            first_paragraph = None
 
-        # Đếm số từ trong đoạn hiện tại
-        word_count = len(current_paragraph.get('full_text', '').split())
-
-        # Nếu đoạn hiện tại ngắn, gộp nó với đoạn kế tiếp
-        if word_count < n_word:
-            next_paragraph = paragraphs[i + 1]
+        if first_paragraph is None:
+            first_paragraph = paragraph
+            text_parts = [text]
+            word_count = len(text.split())
+        else:
+            # Đếm số từ của riêng đoạn mới thay vì tách lại toàn bộ text đã gộp
+            text_parts.append(text)
+            word_count += len(text.split())
 
-            # Gộp text của đoạn sau vào đoạn hiện tại
-            current_paragraph['full_text'] += " " + next_paragraph.get('full_text', '')
+    if first_paragraph is not None:
+        yield dict(first_paragraph, full_text=" ".join(text_parts))
 
-            # Xóa đoạn kế tiếp khỏi list sau khi đã gộp
-            paragraphs.pop(i + 1)
+def merge_short_paragraphs(pdf_result_all_paragraphs, n_word=200):
+    """
+    Gộp các đoạn văn bản ngắn (dưới n_word từ) với đoạn văn bản kế tiếp nó.
+    List và các dict đầu vào không bị thay đổi.
 
-            # QUAN TRỌNG: Không tăng 'i'
-            # Giữ nguyên 'i' để kiểm tra lại chính đoạn vừa được gộp
-            # vì nó có thể vẫn còn ngắn và cần gộp tiếp với đoạn sau nữa.
-        else:
-            # Nếu đoạn hiện tại đã đủ dài, chuyển sang kiểm tra đoạn tiếp theo
-            i += 1
+    Args:
+        pdf_result_all_paragraphs (iterable): List các dictionary, mỗi dictionary là một đoạn.
+                                              Mỗi dict phải có key 'full_text'.
+        n_word (int): Ngưỡng số từ. Nếu đoạn có ít hơn n_word từ, nó sẽ được gộp.
 
-    return paragraphs
+    Returns:
+        list: List mới gồm các đoạn đã được gộp.
+    """
+    return list(iter_merged_paragraphs(pdf_result_all_paragraphs, n_word=n_word))
@@ -0,0 +1,188 @@
+import json
+from PDF_Processor import summarize_and_extract_keyword
+from LLMExecutor import is_retryable_error
+
+# Giới hạn của một request gộp: tổng số token (ước tính) của các đoạn văn và số đoạn văn tối đa
+PACK_MAX_TOKENS = 3000
+PACK_MAX_PARAGRAPHS = 8
+
+PACKED_SYSTEM_PROMPT = '''
+            Bạn là chuyên gia trong việc tóm tắt và trích xuất từ khóa cho các văn bản lịch sử.
+            Đầu vào là một JSON array các đoạn văn, mỗi phần tử có dạng {"id": số thứ tự, "text": đoạn văn}.
+            Với TỪNG đoạn văn:
+            - summary: tóm tắt ngắn gọn đoạn văn nhưng tuyệt đối không được làm mất đi các thông tin lịch sử quan trọng.
+            - keyword: một từ/cụm từ khóa có thể thể hiện tổng quát nội dung cốt lõi của đoạn văn.
+            YÊU CẦU:
+            Mỗi đoạn văn được xử lý độc lập, không trộn thông tin giữa các đoạn.
+            Chỉ trả về một JSON object có dạng
+            {"results": [{"id": số thứ tự, "summary": "...", "keyword": "..."}, ...]}
+            với đúng một phần tử cho mỗi id đầu vào, không đưa thông tin gì thêm.
+            '''
+
+# Số token tương đương của system prompt và phần định dạng khi gửi một đoạn văn riêng lẻ (summarize_and_extract_keyword)
+SINGLE_REQUEST_OVERHEAD_TOKENS = 200
+
+def estimate_tokens(text):
+    """
+    Ước tính số token của text mà không cần tokenizer: tiếng Việt có dấu trung bình khoảng 3 ký tự/token.
+    """
+    return max(1, len(text) // 3)
+
+def pack_paragraphs(texts, max_tokens=PACK_MAX_TOKENS, max_paragraphs=PACK_MAX_PARAGRAPHS):
+    """
+    Gom các đoạn văn liên tiếp thành từng nhóm sao cho tổng số token ước tính không vượt max_tokens.
+    Đoạn văn dài hơn max_tokens được đặt riêng một nhóm.
+    Returns:
+        list: List các list vị trí đoạn văn trong texts.
+    """
+    packs = []
+    current_pack = []
+    current_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current_pack and (current_tokens + tokens > max_tokens or len(current_pack) >= max_paragraphs):
+            packs.append(current_pack)
+            current_pack = []
+            current_tokens = 0
+        current_pack.append(position)
+        current_tokens += tokens
+    if current_pack:
+        packs.append(current_pack)
+    return packs
+
+def _parse_packed_response(content, n_paragraphs):
+    """
+    Tách kết quả của request gộp theo id.
+    Returns:
+        list các tuple (summary, keyword) theo thứ tự id, hoặc None nếu kết quả không khớp với đầu vào
+        (JSON sai, thiếu/thừa/trùng id hoặc trường rỗng).
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    results = data.get('results') if isinstance(data, dict) else None
+    if not isinstance(results, list) or len(results) != n_paragraphs:
+        return None
+
+    by_id = {}
+    for item in results:
+        if not isinstance(item, dict):
+            return None
+        paragraph_id = item.get('id')
+        summary = item.get('summary')
+        keyword = item.get('keyword')
+        if (not isinstance(paragraph_id, int) or paragraph_id in by_id
+                or not isinstance(summary, str) or not isinstance(keyword, str)
+                or not summary.strip() or not keyword.strip()):
+            return None
+        by_id[paragraph_id] = (summary.strip(), keyword.strip())
+
+    if sorted(by_id) != list(range(n_paragraphs)):
+        return None
+    return [by_id[paragraph_id] for paragraph_id in range(n_paragraphs)]
+
+def _packed_user_content(texts):
+    return json.dumps([{'id': paragraph_id, 'text': text} for paragraph_id, text in enumerate(texts)],
+                      ensure_ascii=False)
+
+def summarize_pack(client, texts):
+    """
+    Tóm tắt và trích xuất từ khóa cho nhiều đoạn văn trong một lần gọi LLM.
+    Returns:
+        list các tuple (summary, keyword), hoặc None nếu kết quả không khớp với các đoạn văn.
+    """
+    try:
+        response = client.chat.completions.create(
+                model='gpt-4o-mini',
+                temperature=0,
+                response_format={"type": "json_object"},
+
+            messages=[
+                {
+                    "role": "system",
+                    "content": PACKED_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": _packed_user_content(texts)
+                }
+                ]
+            )
+    except Exception as e:
+        if is_retryable_error(e):
+            raise
+        print(f"⚠️  Lỗi khi gọi LLM cho nhóm {len(texts)} đoạn văn: {str(e)}")
+        return None
+    return _parse_packed_response(response.choices[0].message.content, len(texts))
+
+def _summarize_pack_with_fallback(client, texts):
+    """
+    Returns:
+        tuple: (list các (summary, keyword), True nếu phải gọi riêng từng đoạn)
+    """
+    if len(texts) > 1:
+        results = summarize_pack(client, texts)
+        if results is not None:
+            return results, False
+        print(f"⚠️  Kết quả của nhóm {len(texts)} đoạn văn không khớp, gọi riêng từng đoạn")
+    return [summarize_and_extract_keyword(client, text) for text in texts], len(texts) > 1
+
+def summarize_paragraphs_packed(client, texts, checkpoint=None, executor=None, max_tokens=PACK_MAX_TOKENS,
+                                max_paragraphs=PACK_MAX_PARAGRAPHS):
+    """
+    Tóm tắt và trích xuất từ khóa cho danh sách đoạn văn, gom nhiều đoạn vào một request.
+    Kết quả được lưu vào checkpoint ở bước 'summary_keyword' (dùng chung với chế độ gọi từng đoạn).
+
+    Args:
+        texts (list): Danh sách đoạn văn.
+        checkpoint (IngestionCheckpoint): Checkpoint của job, None = không lưu.
+        executor (LLMExecutor): Nếu có, các nhóm được gửi đồng thời, None = tuần tự.
+        max_tokens (int): Tổng số token ước tính tối đa của các đoạn văn trong một request.
+        max_paragraphs (int): Số đoạn văn tối đa trong một request.
+
+    Returns:
+        tuple: (list các (summary, keyword) theo thứ tự texts, dict thống kê)
+    """
+    results = checkpoint.load_results('summary_keyword', texts) if checkpoint is not None else {}
+    if results:
+        print(f"♻️  Bước 'summary_keyword': dùng lại {len(results)}/{len(texts)} kết quả từ checkpoint")
+
+    pending_positions = [position for position in range(len(texts)) if position not in results]
+    pending_texts = [texts[position] for position in pending_positions]
+    packs = [[pending_positions[i] for i in pack]
+             for pack in pack_paragraphs(pending_texts, max_tokens, max_paragraphs)]
+
+    func = lambda pack: _summarize_pack_with_fallback(client, [texts[position] for position in pack])
+    if executor is not None:
+        completed = executor.iter_completed(func, enumerate(packs))
+    else:
+        completed = ((pack_id, func(pack)) for pack_id, pack in enumerate(packs))
+
+    n_requests = 0
+    packed_tokens = 0
+    for pack_id, (pack_results, used_fallback) in completed:
+        pack = packs[pack_id]
+        pack_texts = [texts[position] for position in pack]
+        if len(pack) > 1:
+            n_requests += 1
+            packed_tokens += estimate_tokens(PACKED_SYSTEM_PROMPT) + estimate_tokens(_packed_user_content(pack_texts))
+        if used_fallback or len(pack) == 1:
+            n_requests += len(pack)
+            packed_tokens += sum(SINGLE_REQUEST_OVERHEAD_TOKENS + estimate_tokens(text) for text in pack_texts)
+        for position, value in zip(pack, pack_results):
+            results[position] = value
+            if checkpoint is not None:
+                checkpoint.save_result('summary_keyword', position, texts[position], value)
+
+    single_tokens = sum(SINGLE_REQUEST_OVERHEAD_TOKENS + estimate_tokens(text) for text in pending_texts)
+    stats = {
+        'paragraphs': len(pending_texts),
+        'requests': n_requests,
+        'requests_saved': len(pending_texts) - n_requests,
+        'estimated_input_tokens': packed_tokens,
+        'estimated_tokens_saved': single_tokens - packed_tokens,
+    }
+    print(f"📦 Gom {stats['paragraphs']} đoạn văn vào {stats['requests']} request: "
+          f"tiết kiệm {stats['requests_saved']} request, khoảng {stats['estimated_tokens_saved']} token đầu vào")
+    return [tuple(results[position]) for position in range(len(texts))], stats
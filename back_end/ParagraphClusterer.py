@@ -5,6 +5,194 @@ from sklearn.decomposition import PCA
 from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib.pyplot as plt
 import numpy as np
+import hashlib
+from joblib import Parallel, delayed
+from scipy.cluster.hierarchy import linkage, fcluster
+from FindOptimalK import find_optimal_k_elbow
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingStore:
+    """
+    Lưu embedding của các đoạn văn theo SHA-256 của text, để mỗi text chỉ được nhúng một lần
+    dù xuất hiện ở nhiều vòng phân cụm hoặc khi tạo ontology.
+    """
+
+    def __init__(self, model_embedding):
+        self.model = model_embedding
+        self._embeddings = {}
+
+    def __contains__(self, text):
+        return text_hash(text) in self._embeddings
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def encode(self, texts: list, show_progress_bar: bool = True) -> np.ndarray:
+        """
+        Trả về ma trận embedding (chưa chuẩn hóa) theo thứ tự texts, chỉ nhúng các text chưa có trong store
+        (trong một lần encode).
+        """
+        hashes = [text_hash(text) for text in texts]
+        new_texts = {}
+        for text_key, text in zip(hashes, texts):
+            if text_key not in self._embeddings and text_key not in new_texts:
+                new_texts[text_key] = text
+
+        if new_texts:
+            print(f"Nhúng {len(new_texts)}/{len(texts)} đoạn văn chưa có embedding...")
+            new_embeddings = self.model.encode(list(new_texts.values()), show_progress_bar=show_progress_bar)
+            self._embeddings.update(zip(new_texts.keys(), np.asarray(new_embeddings)))
+        return np.stack([self._embeddings[text_key] for text_key in hashes]) if hashes else np.zeros((0, 0))
+
+    def get(self, text):
+        """Embedding đã lưu của text, None nếu chưa có."""
+        return self._embeddings.get(text_hash(text))
+
+def _split_worst_cluster(X, model):
+    """
+    Centroid khởi tạo cho k+1 cụm: các centroid của lời giải k cộng với điểm xa centroid nhất
+    trong cụm có WCSS lớn nhất (tách cụm đó làm hai).
+    """
+    labels = model.labels_
+    square_distances = np.sum((X - model.cluster_centers_[labels]) ** 2, axis=1)
+    cluster_wcss = np.bincount(labels, weights=square_distances, minlength=len(model.cluster_centers_))
+    members = np.flatnonzero(labels == np.argmax(cluster_wcss))
+    farthest = members[np.argmax(square_distances[members])]
+    return np.vstack([model.cluster_centers_, X[farthest]])
+
+def _kmeans_chain_inertias(X, k_values, random_state, n_init, max_iter, warm_start=False):
+    """
+    WCSS của các k liên tiếp trong k_values. Mỗi k được fit từ đầu với k-means++, trừ khi warm_start:
+    khi đó chỉ k đầu tiên chạy từ đầu, mỗi k tiếp theo khởi tạo từ lời giải trước (_split_worst_cluster).
+    """
+    inertias = []
+    model = None
+    for k in k_values:
+        if warm_start and model is not None and k == model.n_clusters + 1:
+            init, k_n_init = _split_worst_cluster(X, model), 1
+        else:
+            init, k_n_init = 'k-means++', n_init
+        model = MiniBatchKMeans(
+            n_clusters=k,
+            init=init,
+            random_state=random_state,
+            n_init=k_n_init,
+            max_iter=max_iter,
+            batch_size=256 # Kích thước lô xử lý, có thể điều chỉnh
+        )
+        model.fit(X)
+        inertias.append(model.inertia_)
+    return inertias
+
+def _knee_is_stable(k_values, inertias, knee_history, patience):
+    """
+    Ghi điểm knee của đường cong hiện tại vào knee_history và cho biết knee đã ổn định chưa:
+    không đổi qua patience lần tính gần nhất và k lớn nhất đã vượt gấp đôi knee.
+    """
+    if len(inertias) < 3 or inertias[0] == inertias[-1]:
+        knee_history.clear()
+        return False
+    knee = find_optimal_k_elbow(k_values, inertias, method='knee', plot=False)
+    if knee_history and knee_history[-1] != knee:
+        knee_history.clear()
+    knee_history.append(knee)
+    return len(knee_history) > patience and k_values[-1] >= 2 * knee
+
+def linkage_level_labels(normalized_embeddings, branching_factor=4, method='ward'):
+    """
+    Dựng toàn bộ cây từ một lần linkage trên vector các đoạn văn lá rồi cắt thành các tầng,
+    mỗi tầng có khoảng 1/branching_factor số cụm của tầng dưới, đến khi còn 1 cụm.
+    Các lát cắt của cùng một cây linkage lồng nhau nên mỗi cụm tầng dưới nằm trọn trong một cụm tầng trên.
+
+    Args:
+        normalized_embeddings (np.ndarray): Vector đã chuẩn hóa của các đoạn văn lá.
+        branching_factor (int): Số con trung bình của một node (>= 2).
+        method (str): 'ward' hoặc 'average' (khoảng cách cosine).
+
+    Returns:
+        list: Mỗi phần tử là mảng nhãn cụm 0..k-1 của một vòng, đánh trên các cụm của vòng trước
+              (vòng 1 đánh trên các đoạn văn lá); cụm được đánh số theo thứ tự xuất hiện.
+    """
+    if branching_factor < 2:
+        raise ValueError("branching_factor phải >= 2")
+    n_samples = len(normalized_embeddings)
+    if n_samples < 2:
+        return []
+
+    if method == 'ward':
+        Z = linkage(normalized_embeddings, method='ward')
+    elif method == 'average':
+        Z = linkage(normalized_embeddings, method='average', metric='cosine')
+    else:
+        raise ValueError("Method phải là 'ward' hoặc 'average'")
+
+    rounds = []
+    # Nhãn cụm của vòng trước cho từng đoạn văn lá, vòng 0 là chính các đoạn văn
+    previous_leaf_labels = np.arange(n_samples)
+    n_previous = n_samples
+    while n_previous > 1:
+        leaf_labels = fcluster(Z, max(1, int(np.ceil(n_previous / branching_factor))), criterion='maxclust')
+        # Nhãn của mỗi cụm vòng trước = nhãn của một đoạn văn lá bất kỳ trong cụm đó
+        parent_of_previous = np.zeros(n_previous, dtype=int)
+        parent_of_previous[previous_leaf_labels] = leaf_labels
+        _, first_positions, inverse = np.unique(parent_of_previous, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first_positions))
+        round_labels = order[inverse.ravel()]
+        if round_labels.max() + 1 >= n_previous:
+            # Khoảng cách bằng nhau có thể làm lát cắt không giảm số cụm, gom thẳng về 1 cụm
+            round_labels = np.zeros(n_previous, dtype=int)
+        rounds.append(round_labels)
+        previous_leaf_labels = round_labels[previous_leaf_labels]
+        n_previous = int(round_labels.max()) + 1
+    return rounds
+
+def select_representatives(normalized_embeddings, labels, cluster_centers=None, num_clusters=None,
+                           method='centroid', top_m=1):
+    """
+    Chọn đoạn văn đại diện cho tất cả các cụm cùng lúc, không lặp qua từng cụm.
+    Điểm của mỗi đoạn văn được tính bằng một phép nhân ma trận với vector của cụm chứa nó,
+    sau đó một lần sắp xếp theo (nhãn cụm, điểm giảm dần) chia các đoạn văn thành từng đoạn liên tiếp theo cụm.
+
+    Args:
+        normalized_embeddings (np.ndarray): Vector đã chuẩn hóa của các đoạn văn.
+        labels (array-like): Nhãn cụm 0..num_clusters-1 của từng đoạn văn.
+        cluster_centers (np.ndarray): Tâm cụm, cần khi method='centroid'.
+        num_clusters (int): Số cụm, mặc định = nhãn lớn nhất + 1.
+        method (str): 'centroid' - cosine với tâm cụm,
+                      'medoid' - tổng cosine với các đoạn văn khác trong cụm, tính qua tổng vector của cụm.
+        top_m (int): Số đoạn đại diện trả về cho mỗi cụm.
+
+    Returns:
+        tuple: (members, representatives) - members[c] là list vị trí các đoạn văn của cụm c theo thứ tự tăng dần,
+               representatives[c] là list tối đa top_m vị trí có điểm cao nhất (phần tử đầu là đại diện chính).
+    """
+    labels = np.asarray(labels)
+    if num_clusters is None:
+        num_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+    if method == 'centroid':
+        center_norms = np.linalg.norm(cluster_centers, axis=1, keepdims=True)
+        unit_centers = cluster_centers / np.where(center_norms == 0, 1.0, center_norms)
+        scores = np.einsum('ij,ij->i', normalized_embeddings, unit_centers[labels])
+    elif method == 'medoid':
+        # Với vector đơn vị, tổng cosine của x_i với cả cụm = x_i · (tổng vector của cụm)
+        cluster_sums = np.zeros((num_clusters, normalized_embeddings.shape[1]))
+        np.add.at(cluster_sums, labels, normalized_embeddings)
+        scores = np.einsum('ij,ij->i', normalized_embeddings, cluster_sums[labels])
+    else:
+        raise ValueError("Method phải là 'centroid' hoặc 'medoid'")
+
+    counts = np.bincount(labels, minlength=num_clusters)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # lexsort ổn định: cùng điểm thì đoạn văn đứng trước được chọn, giống np.argmax
+    by_score = np.lexsort((-scores, labels))
+    by_index = np.argsort(labels, kind='stable')
+
+    members = [by_index[start:start + count].tolist() for start, count in zip(starts, counts)]
+    representatives = [by_score[start:start + min(count, top_m)].tolist() for start, count in zip(starts, counts)]
+    return members, representatives
 
 class ParagraphClusterer:
     """
@@ -13,29 +201,35 @@ class ParagraphClusterer:
     và trực quan hóa kết quả phân cụm bằng PCA.
     """
 
-    def __init__(self, model_embedding):
+    def __init__(self, model_embedding, embedding_store=None):
         """
         Khởi tạo ParagraphClusterer với một mô hình S-BERT.
 
         Args:
             model_name (str): Tên của mô hình S-BERT để sử dụng.
                               (Ví dụ: 'paraphrase-multilingual-MiniLM-L12-v2')
+            embedding_store (EmbeddingStore): Store dùng chung để không nhúng lại các đoạn văn đã nhúng.
         """
         self.model = model_embedding
+        self.embedding_store = embedding_store if embedding_store is not None else EmbeddingStore(model_embedding)
         self.paragraphs = []
         self.keywords = []
         self.paragraph_embeddings = None
         self.normalized_embeddings = None
         self.cluster_labels = None
         self.kmeans_model = None
+        self.cluster_centers = None
         self.num_clusters = 0
 
-    def embed_paragraphs(self, paragraphs: list, keywords: list):
+    def embed_paragraphs(self, paragraphs: list, keywords: list, source_indices: list = None):
         """
         Nhúng (embed) danh sách các đoạn văn thành vector số sử dụng S-BERT.
+        Đoạn văn đã có trong embedding_store không bị nhúng lại.
 
         Args:
             paragraphs (list): Một list các chuỗi (đoạn văn).
+            source_indices (list): Nếu mỗi đoạn văn là một đoạn của lần nhúng trước (ví dụ đoạn đại diện của vòng trước),
+                                   vị trí của chúng trong lần nhúng trước. Ma trận mới được cắt từ ma trận cũ, không cần nhúng.
         """
         if not paragraphs:
             print("Danh sách đoạn văn rỗng. Không thể nhúng.")
@@ -45,10 +239,18 @@ class ParagraphClusterer:
             self.normalized_embeddings = None
             return
 
+        if source_indices is not None and self.paragraph_embeddings is not None:
+            self.paragraphs = paragraphs
+            self.keywords = keywords
+            self.paragraph_embeddings = self.paragraph_embeddings[source_indices]
+            self.normalized_embeddings = self.normalized_embeddings[source_indices]
+            print("Dùng lại vector của vòng trước, không cần nhúng lại.")
+            return
+
         self.paragraphs = paragraphs
         self.keywords = keywords
         print("Đang nhúng các đoạn văn thành vector...")
-        self.paragraph_embeddings = self.model.encode(paragraphs, show_progress_bar=True)
+        self.paragraph_embeddings = self.embedding_store.encode(paragraphs, show_progress_bar=True)
         # Chuẩn hóa vector ngay sau khi nhúng để sử dụng cho K-Means với cosine affinity
         self.normalized_embeddings = normalize(self.paragraph_embeddings, axis=1)
         print("Hoàn tất nhúng và chuẩn hóa vector.")
@@ -93,68 +295,73 @@ class ParagraphClusterer:
         )
         self.kmeans_model.fit(self.normalized_embeddings)
         self.cluster_labels = self.kmeans_model.labels_
+        self.cluster_centers = self.kmeans_model.cluster_centers_
         print("Hoàn tất phân cụm K-Means.")
         return True
 
-    # --- Hàm tìm đoạn văn đại diện dưới dạng staticmethod ---
-    @staticmethod
-    def find_representative_paragraph(
-        paragraph_indices_in_cluster: list,
-        normalized_embeddings: np.ndarray,
-        cluster_center_embedding: np.ndarray
-    ) -> str:
+    def assign_cluster_labels(self, labels):
         """
-        Tìm đoạn văn gần nghĩa nhất với tâm cụm từ danh sách các đoạn văn trong cụm.
-        Đây là một phương thức tĩnh vì nó không cần truy cập thuộc tính của đối tượng (self).
-        """
-        if not paragraph_indices_in_cluster:
-            print("Danh sách đoạn văn trong cụm rỗng. Không thể tìm đoạn văn đại diện.")
-            return "Không có đoạn văn trong cụm này."
+        Dùng nhãn cụm có sẵn (ví dụ cắt từ cây linkage) thay cho K-Means.
+        Tâm cụm là trung bình các vector đã chuẩn hóa trong cụm, giống tâm cụm của K-Means.
 
-        cluster_embeddings = normalized_embeddings[paragraph_indices_in_cluster]
-        current_cluster_center_reshaped = cluster_center_embedding.reshape(1, -1)
+        Args:
+            labels (array-like): Nhãn cụm 0..k-1 của từng đoạn văn.
 
-        similarities = cosine_similarity(cluster_embeddings, current_cluster_center_reshaped).flatten()
+        Returns:
+            bool: True nếu gán thành công, False nếu không.
+        """
+        if self.normalized_embeddings is None or not self.paragraphs:
+            print("Chưa có vector đoạn văn nào được nhúng. Vui lòng gọi `embed_paragraphs` trước.")
+            return False
 
-        most_representative_index_in_cluster = np.argmax(similarities)
-        original_paragraph_index = paragraph_indices_in_cluster[most_representative_index_in_cluster]
+        labels = np.asarray(labels)
+        if len(labels) != len(self.normalized_embeddings):
+            print(f"Số nhãn ({len(labels)}) khác số đoạn văn ({len(self.normalized_embeddings)}).")
+            return False
 
-        return original_paragraph_index
+        self.kmeans_model = None
+        self.cluster_labels = labels
+        self.num_clusters = int(labels.max()) + 1
+        sums = np.zeros((self.num_clusters, self.normalized_embeddings.shape[1]))
+        np.add.at(sums, labels, self.normalized_embeddings)
+        self.cluster_centers = sums / np.maximum(np.bincount(labels, minlength=self.num_clusters), 1)[:, None]
+        return True
 
-    def get_cluster_info(self):
+    def get_cluster_info(self, representative_method='centroid', top_m=1):
         """
         Lấy thông tin chi tiết về từng cụm đã được phân loại, bao gồm đoạn văn
         gần nghĩa nhất với tâm cụm làm đại diện.
+        Đại diện của mọi cụm được chọn cùng lúc bằng select_representatives.
+
+        Args:
+            representative_method (str): 'centroid' (gần tâm cụm nhất) hoặc 'medoid'.
+            top_m (int): Số đoạn đại diện lưu trong "represent_indices" của mỗi cụm.
         """
-        if self.cluster_labels is None or not self.paragraphs or self.kmeans_model is None:
+        if self.cluster_labels is None or not self.paragraphs or self.cluster_centers is None:
             print("Chưa có thông tin cụm. Vui lòng chạy `embed_paragraphs` và `perform_kmeans_clustering` trước.")
             return []
 
-        clustered_data = [[] for _ in range(self.num_clusters)]
-        for i, label in enumerate(self.cluster_labels):
-            clustered_data[label].append(i)
+        members, representatives = select_representatives(
+            self.normalized_embeddings,
+            self.cluster_labels,
+            self.cluster_centers,
+            self.num_clusters,
+            method=representative_method,
+            top_m=top_m
+        )
 
         results = []
-        cluster_centers = self.kmeans_model.cluster_centers_
-
         for cluster_id in range(self.num_clusters):
-            if len(clustered_data[cluster_id]) == 0:
+            if len(members[cluster_id]) == 0:
                 print(f"Cụm {cluster_id} rỗng. Không có đoạn văn nào trong cụm này.")
                 continue
 
-            paragraph_indices_in_cluster = clustered_data[cluster_id]
-            current_cluster_center_embedding = cluster_centers[cluster_id]
-
-            # Gọi staticmethod
-            representative_paragraph_index = ParagraphClusterer.find_representative_paragraph(
-                paragraph_indices_in_cluster,
-                self.normalized_embeddings,
-                current_cluster_center_embedding
-            )
-
+            representative_paragraph_index = representatives[cluster_id][0]
             results.append({
                 "ID_of_cluster": cluster_id,
-                "index_from_list_paragraph": paragraph_indices_in_cluster,
+                "index_from_list_paragraph": members[cluster_id],
+                "represent_index": representative_paragraph_index,
+                "represent_indices": representatives[cluster_id],
                 "represent": self.paragraphs[representative_paragraph_index],
                 "keyword": self.keywords[representative_paragraph_index]
             })
@@ -168,12 +375,12 @@ class ParagraphClusterer:
             dict: Dictionary chứa độ tương đồng cosine trung bình cho mỗi cụm.
                   Trả về dictionary rỗng nếu chưa phân cụm.
         """
-        if self.cluster_labels is None or self.kmeans_model is None:
+        if self.cluster_labels is None or self.cluster_centers is None:
             print("Chưa có thông tin cụm để tính độ tương đồng. Vui lòng chạy `perform_kmeans_clustering` trước.")
             return {}
 
         avg_cosine_similarities_per_cluster = {}
-        cluster_centers = self.kmeans_model.cluster_centers_ # Tâm cụm đã được chuẩn hóa
+        cluster_centers = self.cluster_centers # Tâm cụm đã được chuẩn hóa
 
         for cluster_id in range(self.num_clusters):
             paragraph_indices_in_cluster = np.where(self.cluster_labels == cluster_id)[0]
@@ -226,7 +433,7 @@ class ParagraphClusterer:
                         s=50, color=colors(i), label=f'Cụm {i}', alpha=0.7)
 
         # Vẽ tâm cụm (sau khi giảm chiều)
-        reduced_cluster_centers = pca.transform(self.kmeans_model.cluster_centers_)
+        reduced_cluster_centers = pca.transform(self.cluster_centers)
         plt.scatter(reduced_cluster_centers[:, 0], reduced_cluster_centers[:, 1],
                     s=200, marker='X', color='black', label='Tâm cụm', edgecolor='white', linewidth=1.5)
 
@@ -237,7 +444,9 @@ class ParagraphClusterer:
         plt.grid(True)
         plt.show()
 
-    def find_optimal_clusters_elbow(self, k_range: range, random_state: int = 42, n_init='auto', max_iter: int = 300):
+    def find_optimal_clusters_elbow(self, k_range: range, random_state: int = 42, n_init='auto', max_iter: int = 300,
+                                    n_jobs: int = 1, warm_start: bool = False, warm_chain_length: int = 8,
+                                    early_stop_patience: int = None):
         """
         Tìm số cụm tối ưu bằng phương pháp Elbow (WCSS - Inertia)
         sử dụng MiniBatchKMeans.
@@ -247,9 +456,17 @@ class ParagraphClusterer:
             random_state (int): Hạt giống cho khả năng tái tạo của K-Means.
             n_init (int or 'auto'): Số lần chạy K-Means với các hạt giống centroid khác nhau.
             max_iter (int): Số lần lặp tối đa của thuật toán K-Means.
+            n_jobs (int): Số process (joblib) chạy song song các giá trị k, 1 = tuần tự.
+            warm_start (bool): Khởi tạo k+1 từ centroid của lời giải k cộng thêm một centroid tách từ cụm
+                               có WCSS lớn nhất. Các k được chia thành các chuỗi cố định warm_chain_length giá trị,
+                               mỗi chuỗi bắt đầu lạnh, nên kết quả không phụ thuộc n_jobs.
+            warm_chain_length (int): Số giá trị k liên tiếp trong một chuỗi (một tác vụ khi chạy song song).
+            early_stop_patience (int): Dừng sớm khi điểm knee của đường cong đã tính không đổi qua
+                                       early_stop_patience giá trị k liên tiếp và k đã vượt gấp đôi knee.
+                                       None = tính hết k_range.
 
         Returns:
-            list: Một list các giá trị WCSS (inertia) tương ứng với mỗi k.
+            list: Một list các giá trị WCSS (inertia) tương ứng với mỗi k (ngắn hơn k_range nếu dừng sớm).
         """
         if self.normalized_embeddings is None:
             print("Chưa có vector đoạn văn nào được nhúng. Vui lòng gọi `embed_paragraphs` trước.")
@@ -263,24 +480,36 @@ class ParagraphClusterer:
                 print("Phạm vi k không hợp lệ sau khi điều chỉnh.")
                 return []
 
+        # Bỏ qua k=0 vì không hợp lệ, không thể có số cụm nhiều hơn số điểm
+        k_values = [k for k in k_range if 0 < k <= len(self.normalized_embeddings)]
+        # Mỗi chuỗi là một tác vụ; không warm start thì chỉ gom k thành chuỗi khi chạy song song để giảm chi phí gửi tác vụ
+        chain_length = warm_chain_length if warm_start or n_jobs > 1 else 1
+        chains = [k_values[start:start + chain_length] for start in range(0, len(k_values), chain_length)]
 
         inertias = []
+        knee_history = []
         print(f"Đang chạy MiniBatchKMeans để tìm k tối ưu qua phương pháp Elbow (kiểm tra k từ {k_range.start} đến {k_range.stop - 1})...")
-        for k in k_range:
-            if k == 0: continue # Bỏ qua k=0 vì không hợp lệ
-            if k > len(self.normalized_embeddings): # Không thể có số cụm nhiều hơn số điểm
-                break
-
-            mb_kmeans = MiniBatchKMeans(
-                n_clusters=k,
-                random_state=random_state,
-                n_init=n_init,
-                max_iter=max_iter,
-                batch_size=256 # Kích thước lô xử lý, có thể điều chỉnh
-            )
-            mb_kmeans.fit(self.normalized_embeddings)
-            inertias.append(mb_kmeans.inertia_)
-            print(f"  Đã tính WCSS cho k={k}: {mb_kmeans.inertia_:.2f}")
+        # Mỗi lượt chạy n_jobs chuỗi song song, kết quả được ghép theo thứ tự k nên giống hệt khi chạy tuần tự
+        for block_start in range(0, len(chains), max(1, n_jobs)):
+            block = chains[block_start:block_start + max(1, n_jobs)]
+            if n_jobs > 1 and len(block) > 1:
+                block_inertias = Parallel(n_jobs=n_jobs)(
+                    delayed(_kmeans_chain_inertias)(self.normalized_embeddings, chain, random_state, n_init, max_iter,
+                                                    warm_start)
+                    for chain in block)
+            else:
+                block_inertias = [_kmeans_chain_inertias(self.normalized_embeddings, chain, random_state, n_init,
+                                                         max_iter, warm_start)
+                                  for chain in block]
+
+            for chain, chain_inertias in zip(block, block_inertias):
+                for k, inertia in zip(chain, chain_inertias):
+                    inertias.append(inertia)
+                    print(f"  Đã tính WCSS cho k={k}: {inertia:.2f}")
+                    if early_stop_patience and _knee_is_stable(k_values[:len(inertias)], inertias, knee_history,
+                                                               early_stop_patience):
+                        print(f"  Dừng sớm tại k={k}: điểm knee k={knee_history[-1]} đã ổn định")
+                        return inertias
 
         # # Vẽ biểu đồ Elbow
         # plt.figure(figsize=(10, 6))
@@ -1,26 +1,80 @@
 from ParagraphClusterer import *
 from ClusteringTreeBuilder import *
-from PDF_Processor import summary_paragraph, extract_key_word
+from PDF_Processor import summary_paragraph, extract_key_word, summarize_and_extract_keyword
 import time
 from FindOptimalK import get_optimal_k_with_final_merge_logic
-def run_clustering_with_tree_building(client, model_embedding, list_node , clustering_strategy='adaptive'):
+from IngestionCheckpoint import map_with_checkpoint
+from PackedSummarizer import summarize_paragraphs_packed
+from BatchIngestion import run_batch_extraction
+from LocalSummarizer import LocalSummarizer
+def run_clustering_with_tree_building(client, model_embedding, list_node , clustering_strategy='adaptive', checkpoint=None,
+                                      llm_executor=None, extraction_mode='separate',
+                                      batch_backend=None, llm_min_round=None, embedding_store=None,
+                                      k_engine='kmeans', kmeans_sweep_options=None, tree_engine='rounds',
+                                      branching_factor=4, linkage_method='ward'):
     """
     Chạy phân cụm và xây dựng cây đồng thời
+
+    Args:
+        checkpoint: IngestionCheckpoint lưu kết quả tóm tắt và từ khóa của từng đoạn văn,
+                    lần chạy lại chỉ gọi LLM cho các đoạn chưa có kết quả.
+        llm_executor: LLMExecutor để gọi LLM đồng thời cho các đoạn văn, None = gọi tuần tự.
+        extraction_mode: Cách tóm tắt và tách từ khóa cho các đoạn văn ban đầu:
+                         'separate' = hai lần gọi LLM cho mỗi đoạn văn,
+                         'combined' = một lần gọi LLM cho mỗi đoạn văn,
+                         'packed' = gom nhiều đoạn văn vào một lần gọi LLM,
+                         'batch' = gửi tất cả request qua batch_backend rồi chờ kết quả (nhập hàng loạt),
+                         'local' = tóm tắt trích xuất và từ khóa bằng model embedding, không gọi LLM.
+        batch_backend: BatchBackend dùng cho extraction_mode='batch'.
+        llm_min_round: Nếu có, các node từ vòng này trở lên được tóm tắt lại bằng LLM từ đoạn văn gốc
+                       của đoạn đại diện (thường dùng với extraction_mode='local' để chỉ gọi LLM cho các node phía trên).
+        embedding_store: EmbeddingStore dùng chung, để các bước sau (ví dụ tạo ontology) dùng lại embedding.
+        k_engine: Cách tính đường cong WCSS để chọn k ('kmeans', 'ward', 'average'), xem get_optimal_k_with_final_merge_logic.
+        kmeans_sweep_options: dict tham số thêm cho sweep K-Means khi k_engine='kmeans' (n_jobs, warm_start, early_stop_patience).
+        tree_engine: Cách dựng các tầng của cây:
+                     'rounds' = mỗi vòng chọn k rồi phân cụm K-Means lại các đoạn đại diện,
+                     'linkage' = một lần linkage trên các đoạn văn lá, cắt thành các tầng theo branching_factor
+                                 (linkage_level_labels). Các node có cùng dạng với 'rounds'.
+        branching_factor: Số con trung bình của một node khi tree_engine='linkage'.
+        linkage_method: 'ward' hoặc 'average' khi tree_engine='linkage'.
     """
     # Khởi tạo các đối tượng
-    clusterer = ParagraphClusterer(model_embedding)
+    clusterer = ParagraphClusterer(model_embedding, embedding_store)
     tree_builder = ClusteringTreeBuilder()
 
     # Dữ liệu ban đầu
     initial_paragraphs = [paragraph['full_text'] for paragraph in list_node]
     s_time = time.time()
-    initial_summarized_paragraphs = []
-    for full_paragraph in initial_paragraphs:
-        summarized_paragraph = summary_paragraph(client, full_paragraph )
-        initial_summarized_paragraphs.append(summarized_paragraph)
+    if extraction_mode == 'local':
+        summary_keywords = LocalSummarizer(model_embedding).summarize_and_extract_keywords(initial_paragraphs)
+        initial_summarized_paragraphs = [summary for summary, _ in summary_keywords]
+        list_keywords = [keyword for _, keyword in summary_keywords]
+    elif extraction_mode == 'batch':
+        if batch_backend is None:
+            raise ValueError("extraction_mode='batch' cần batch_backend")
+        summary_keywords = run_batch_extraction(batch_backend, initial_paragraphs, checkpoint, client)
+        initial_summarized_paragraphs = [summary for summary, _ in summary_keywords]
+        list_keywords = [keyword for _, keyword in summary_keywords]
+    elif extraction_mode == 'packed':
+        summary_keywords, _ = summarize_paragraphs_packed(client, initial_paragraphs, checkpoint, llm_executor)
+        initial_summarized_paragraphs = [summary for summary, _ in summary_keywords]
+        list_keywords = [keyword for _, keyword in summary_keywords]
+    elif extraction_mode == 'combined':
+        summary_keywords = map_with_checkpoint(lambda full_paragraph: summarize_and_extract_keyword(client, full_paragraph),
+                                               initial_paragraphs, checkpoint, 'summary_keyword', llm_executor)
+        initial_summarized_paragraphs = [summary for summary, _ in summary_keywords]
+        list_keywords = [keyword for _, keyword in summary_keywords]
+    else:
+        initial_summarized_paragraphs = map_with_checkpoint(lambda full_paragraph: summary_paragraph(client, full_paragraph),
+                                                            initial_paragraphs, checkpoint, 'summary', llm_executor)
+        list_keywords = map_with_checkpoint(lambda paragraph: extract_key_word(client, paragraph),
+                                            initial_paragraphs, checkpoint, 'keyword', llm_executor)
 
     list_paragraphs = initial_summarized_paragraphs.copy()
-    list_keywords = [extract_key_word(client, paragraph) for paragraph in initial_paragraphs]
+    # Đoạn văn gốc ứng với từng phần tử của list_paragraphs, dùng khi tóm tắt lại các node phía trên bằng LLM
+    list_sources = initial_paragraphs.copy()
+    node_sources = {}
+    source_indices = None
     e_time = time.time()
     print(f"Thời gian summarize và tách key word: {e_time - s_time}s")
 
@@ -31,26 +85,39 @@ def run_clustering_with_tree_building(client, model_embedding, list_node , clust
     current_indices = tree_builder.add_initial_paragraphs(client, paragraphs = initial_summarized_paragraphs, keywords=list_keywords)
 
     round_count = 1
+    # PDF trống hoặc chỉ có 1 đoạn: không có gì để gom cụm, trả về cây như chế độ 'rounds'
+    if tree_engine == 'linkage' and len(list_paragraphs) > 1:
+        clusterer.embed_paragraphs(list_paragraphs, list_keywords)
+        level_labels = linkage_level_labels(clusterer.normalized_embeddings, branching_factor, linkage_method)
+        print(f"🌲 Cắt cây linkage ({linkage_method}) thành {len(level_labels)} tầng, mỗi node khoảng {branching_factor} con")
 
     while len(list_paragraphs) > 1:
         print(f"\n{'='*60}")
         print(f"--- VÒNG {round_count} | Số đoạn hiện tại: {len(list_paragraphs)} ---")
         print(f"{'='*60}")
 
-        # Nhúng các đoạn văn thành vector
-        clusterer.embed_paragraphs(list_paragraphs, list_keywords)
+        # Nhúng các đoạn văn thành vector, từ vòng 2 các đoạn đại diện được lấy lại từ ma trận của vòng trước
+        clusterer.embed_paragraphs(list_paragraphs, list_keywords, source_indices)
+
+        if tree_engine == 'linkage':
+            # Tầng của cây linkage đã được tính sẵn, nhãn đánh trên các cụm (đoạn đại diện) của vòng trước
+            clustered = clusterer.assign_cluster_labels(level_labels[round_count - 1])
+        else:
+            # Lấy số cụm tối ưu
+            optimal_k = get_optimal_k_with_final_merge_logic(
+                list_paragraphs,
+                clusterer,
+                clustering_strategy,
+                k_engine,
+                kmeans_sweep_options
+            )
 
-        # Lấy số cụm tối ưu
-        optimal_k = get_optimal_k_with_final_merge_logic(
-            list_paragraphs,
-            clusterer,
-            clustering_strategy
-        )
+            print(f"\n🎯 Số cụm được chọn: {optimal_k}")
 
-        print(f"\n🎯 Số cụm được chọn: {optimal_k}")
+            # Thực hiện phân cụm
+            clustered = clusterer.perform_kmeans_clustering(optimal_k)
 
-        # Thực hiện phân cụm
-        if clusterer.perform_kmeans_clustering(optimal_k):
+        if clustered:
             cluster_info = clusterer.get_cluster_info()
 
             # Thêm vào cây
@@ -64,6 +131,10 @@ def run_clustering_with_tree_building(client, model_embedding, list_node , clust
             previous_count = len(list_paragraphs)
             list_paragraphs = [cluster['represent'] for cluster in cluster_info]
             list_keywords = [cluster['keyword'] for cluster in cluster_info]
+            list_sources = [list_sources[cluster['represent_index']] for cluster in cluster_info]
+            source_indices = [cluster['represent_index'] for cluster in cluster_info]
+            if llm_min_round is not None and round_count >= llm_min_round:
+                node_sources.update(zip(new_indices, list_sources))
 
             current_indices = new_indices
             current_count = len(list_paragraphs)
@@ -86,6 +157,9 @@ def run_clustering_with_tree_building(client, model_embedding, list_node , clust
             print("\n⚠️ Đã chạy quá 20 vòng - Dừng để tránh vô hạn")
             break
 
+    if node_sources:
+        refine_upper_nodes_with_llm(client, tree_builder, node_sources, checkpoint, llm_executor)
+
     # # Hiển thị kết quả
     # tree_builder.print_tree_summary()
     # tree_builder.visualize_tree_structure()
@@ -95,5 +169,26 @@ def run_clustering_with_tree_building(client, model_embedding, list_node , clust
 
     return {
         'tree': tree_builder.get_tree_structure(),
-        'tree_builder': tree_builder
+        'tree_builder': tree_builder,
+        'embedding_store': clusterer.embedding_store
     }
+
+def refine_upper_nodes_with_llm(client, tree_builder, node_sources, checkpoint=None, llm_executor=None):
+    """
+    Tóm tắt và tách từ khóa lại bằng LLM cho các node phía trên của cây.
+
+    Args:
+        node_sources (dict): {index của node: đoạn văn gốc của đoạn đại diện}
+    """
+    node_indices = sorted(node_sources)
+    # Node ở nhiều vòng có thể cùng đoạn đại diện, mỗi đoạn văn chỉ gửi LLM một lần
+    texts = list(dict.fromkeys(node_sources[node_index] for node_index in node_indices))
+    print(f"\n✍️  Tóm tắt lại {len(node_indices)} node phía trên bằng LLM ({len(texts)} đoạn văn khác nhau)")
+    summary_keywords = map_with_checkpoint(lambda text: summarize_and_extract_keyword(client, text),
+                                           texts, checkpoint, 'upper_summary_keyword', llm_executor)
+    summary_keyword_by_text = dict(zip(texts, summary_keywords))
+    for node_index in node_indices:
+        summary, keyword = summary_keyword_by_text[node_sources[node_index]]
+        node = tree_builder.get_node_by_index(node_index)
+        node['summarized_paragraph'] = summary
+        node['keyword'] = keyword
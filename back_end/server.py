@@ -10,17 +10,28 @@ import os
 import json
 import uuid
 import time
-from sentence_transformers import SentenceTransformer
 from collections import defaultdict
 
 # Import các module xử lý chính (giả định đã được đơn giản hóa bên trong)
 from MainProcessor import process_PDF_file, create_ontology
+from ExtractionCache import PDFExtractionCache
+from PDF_Processor import extraction_settings
+from IngestionCheckpoint import IngestionCheckpoint
+from LLMExecutor import LLMExecutor
+from ParagraphClusterer import EmbeddingStore
+from EmbeddingBackend import create_embedding_backend, EmbeddingDispatcher
+from LLMCache import LLMResponseCache, CachedChatClient
 from LLMquery import *
 
 # Giả định YOLOv10 và easyocr không yêu cầu cấu hình đặc biệt cho chế độ tuần tự
 from doclayout_yolo import YOLOv10
 import easyocr
 
+# Worker xử lý PDF khởi tạo bằng 'spawn' chạy lại file này với __name__ == '__mp_main__' (khi server được chạy
+# bằng `python server.py`); khi đó không nạp model, không mở kết nối Redis, không mở các cache SQLite
+# (LLM, trích xuất PDF) và không tạo thread embedding hay LLMExecutor
+IS_PDF_WORKER = __name__ == '__mp_main__'
+
 # --- Cấu hình Flask App ---
 app = Flask(__name__)
 
@@ -48,14 +59,88 @@ GENERATED_ONTOLOGIES_FOLDER = 'generated_ontologies'
 if not os.path.exists(GENERATED_ONTOLOGIES_FOLDER):
     os.makedirs(GENERATED_ONTOLOGIES_FOLDER)
 
+# ONTOLOGY_EMBEDDING_SIDECAR = 1: ghi thêm embedding của các class ra file .embeddings.npz cạnh file ontology
+ONTOLOGY_EMBEDDING_SIDECAR = os.getenv('ONTOLOGY_EMBEDDING_SIDECAR', '0') == '1'
+
+# Thư mục lưu checkpoint của các lần xử lý PDF chưa hoàn thành (theo SHA-256 của file, tham số trích xuất và model)
+INGESTION_JOBS_FOLDER = 'ingestion_jobs'
+if not os.path.exists(INGESTION_JOBS_FOLDER):
+    os.makedirs(INGESTION_JOBS_FOLDER)
+
 # --- Load biến môi trường và Khởi tạo OpenAI Client ---
 load_dotenv(dotenv_path="secrect.env")
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Cache các response có temperature=0, upload lại tài liệu có đoạn văn trùng sẽ không gọi lại API
+# LLM_CACHE = 0: tắt cache
+if not IS_PDF_WORKER and os.getenv('LLM_CACHE', '1') == '1':
+    llm_cache = LLMResponseCache(os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite3'),
+                                 max_bytes=int(os.getenv('LLM_CACHE_MAX_MB', '256')) * 1024 * 1024)
+    client = CachedChatClient(client, llm_cache)
+else:
+    llm_cache = None
 
 # --- Khởi tạo các model ---
-model_detect_layout = YOLOv10("model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt")
-reader = easyocr.Reader(['vi', 'en'], gpu=False)
+LAYOUT_MODEL_PATH = "model/model_detect_layout/doclayout_yolo_docstructbench_imgsz1024.pt"
+OCR_LANGUAGES = ['vi', 'en']
+if IS_PDF_WORKER:
+    model_detect_layout = reader = None
+else:
+    model_detect_layout = YOLOv10(LAYOUT_MODEL_PATH)
+    reader = easyocr.Reader(OCR_LANGUAGES, gpu=False)
+
+# --- Cấu hình xử lý PDF ---
+# PDF_NUM_WORKERS > 1: xử lý các trang song song bằng process pool, mỗi worker tự nạp model riêng
+# PDF_USE_TEXT_LAYER = 0: luôn dùng YOLO + OCR kể cả với trang PDF dạng số
+# PDF_MP_CONTEXT: cách khởi tạo worker. Mặc định 'spawn' (tiến trình mới, chỉ nạp lại những gì worker cần).
+# Không dùng 'fork' cho server: lúc fork, tiến trình server đã có thread của torch, thread EmbeddingDispatcher,
+# kết nối SQLite và Redis; tiến trình con thừa hưởng các lock/kết nối này và có thể bị treo hoặc làm hỏng trạng thái.
+PDF_OPTIONS = {
+    'num_workers': int(os.getenv('PDF_NUM_WORKERS', '1')),
+    'mp_context': os.getenv('PDF_MP_CONTEXT', 'spawn'),
+    'layout_model_path': LAYOUT_MODEL_PATH,
+    'ocr_languages': OCR_LANGUAGES,
+    'use_text_layer': os.getenv('PDF_USE_TEXT_LAYER', '1') == '1',
+    'layout_batch_size': int(os.getenv('PDF_LAYOUT_BATCH_SIZE', '4')),
+    'ocr_batch_size': int(os.getenv('PDF_OCR_BATCH_SIZE', '8')),
+    'ocr_workers': int(os.getenv('PDF_OCR_WORKERS', '0')),
+}
+# Cache kết quả trích xuất theo SHA-256 của file PDF, upload lại cùng một file sẽ bỏ qua render/YOLO/OCR
+if IS_PDF_WORKER:
+    PDF_OPTIONS['cache'] = None
+else:
+    PDF_OPTIONS['cache'] = PDFExtractionCache('pdf_cache',
+                                              max_bytes=int(os.getenv('PDF_CACHE_MAX_MB', '512')) * 1024 * 1024)
+
+# --- Cấu hình gọi LLM ---
+# LLM_MAX_IN_FLIGHT: số request tóm tắt/tách từ khóa chạy đồng thời, 1 = tuần tự
+if IS_PDF_WORKER:
+    llm_executor = None
+else:
+    llm_executor = LLMExecutor(max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '8')),
+                               max_retries=int(os.getenv('LLM_MAX_RETRIES', '5')))
+# LLM_EXTRACTION_MODE: cách tóm tắt và tách từ khóa cho các đoạn văn
+# 'separate' = 2 request/đoạn, 'combined' = 1 request JSON/đoạn, 'packed' = gom nhiều đoạn vào 1 request,
+# 'local' = tóm tắt trích xuất bằng model embedding, không gọi LLM
+# 'batch' không dùng được khi upload (phải chờ Batch API tới 24 giờ), chạy BatchIngestion.py để nạp PDF theo batch
+LLM_EXTRACTION_MODE = os.getenv('LLM_EXTRACTION_MODE', 'combined')
+if LLM_EXTRACTION_MODE == 'batch':
+    raise ValueError("LLM_EXTRACTION_MODE='batch' không dùng được cho server, hãy chạy BatchIngestion.py để nạp PDF theo batch")
+if LLM_EXTRACTION_MODE not in ('separate', 'combined', 'packed', 'local'):
+    raise ValueError(f"LLM_EXTRACTION_MODE không hợp lệ: {LLM_EXTRACTION_MODE}")
+# LLM_MIN_ROUND: các node từ vòng này trở lên được tóm tắt lại bằng LLM (ví dụ 1 khi dùng 'local'), bỏ trống = không
+LLM_MIN_ROUND = int(os.getenv('LLM_MIN_ROUND')) if os.getenv('LLM_MIN_ROUND') else None
+# CLUSTER_K_ENGINE: cách tính WCSS để chọn số cụm mỗi vòng: 'kmeans' (K-Means từng k), 'ward' hoặc 'average' (một lần linkage)
+CLUSTER_K_ENGINE = os.getenv('CLUSTER_K_ENGINE', 'kmeans')
+# Sweep K-Means khi CLUSTER_K_ENGINE='kmeans': số process song song, warm start từ lời giải k-1, dừng sớm khi knee ổn định
+KMEANS_SWEEP_OPTIONS = {
+    'n_jobs': int(os.getenv('KMEANS_SWEEP_JOBS', '1')),
+    'warm_start': os.getenv('KMEANS_WARM_START', '0') == '1',
+    'early_stop_patience': int(os.getenv('KMEANS_EARLY_STOP_PATIENCE')) if os.getenv('KMEANS_EARLY_STOP_PATIENCE') else None,
+}
+# TREE_ENGINE: 'rounds' (phân cụm K-Means từng vòng) hoặc 'linkage' (một lần linkage, cắt tầng theo TREE_BRANCHING_FACTOR)
+TREE_ENGINE = os.getenv('TREE_ENGINE', 'rounds')
+TREE_BRANCHING_FACTOR = int(os.getenv('TREE_BRANCHING_FACTOR', '4'))
 
 # --- Load Ontology mặc định (nếu có) ---
 ONTO_AVAILABLE_PATH = "static/MINDMAP.owl"
@@ -94,20 +179,31 @@ def load_ontologies(type, onto_path = None):
 # --- Model Embedding ---
 # model_embedding_name = "model/model_embedding" #lưu model embedding nếu muốn tải về sử dụng local
 model_embedding_name = 'paraphrase-multilingual-MiniLM-L12-v2'
-model_embedding = SentenceTransformer(model_embedding_name)
+# EMBEDDING_BACKEND: 'float32' (mặc định), 'int8' (PyTorch lượng tử hóa động), 'onnx' hoặc 'onnx-int8' (ONNX Runtime)
+if IS_PDF_WORKER:
+    model_embedding = None
+else:
+    model_embedding = create_embedding_backend(os.getenv('EMBEDDING_BACKEND', 'float32'), model_embedding_name)
+# EMBEDDING_DISPATCHER = 1: gom các lần encode nhỏ từ các request chạy đồng thời thành một batch
+if not IS_PDF_WORKER and os.getenv('EMBEDDING_DISPATCHER', '1') == '1':
+    model_embedding = EmbeddingDispatcher(model_embedding,
+                                          max_batch_size=int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '64')),
+                                          max_wait_ms=float(os.getenv('EMBEDDING_MAX_WAIT_MS', '2')))
 
 # --- Lịch sử Chat trong memory ---
 chat_histories = {}
 
 # Redis client để quản lý trạng thái ontology cho từng session
-try:
-    redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
-    # Test connection
-    redis_client.ping()
-    print("Kết nối Redis thành công")
-except Exception as e:
-    print(f"Không thể kết nối Redis: {e}")
-    redis_client = None
+redis_client = None
+if not IS_PDF_WORKER:
+    try:
+        redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+        # Test connection
+        redis_client.ping()
+        print("Kết nối Redis thành công")
+    except Exception as e:
+        print(f"Không thể kết nối Redis: {e}")
+        redis_client = None
 
 
 # --- Session Management Helper Functions ---
@@ -252,10 +348,26 @@ def upload_pdf():
         pdf_file.save(file_path)
         print(f"File PDF đã lưu tạm thời: {file_path}")
 
+        checkpoint = None
         try:
-            # 1. Thực hiện process_PDF_file đồng bộ
+            # 1. Thực hiện process_PDF_file đồng bộ, upload lại cùng file sau khi lỗi sẽ chạy tiếp từ checkpoint
             print(f"Bắt đầu process_PDF_file đồng bộ cho {file_path}")
-            clustering_tree = process_PDF_file(client, model_embedding, model_detect_layout, reader, file_path)
+            # Khóa job gồm nội dung file, các tham số trích xuất và file model; upload trùng đang chạy dùng thư mục riêng
+            checkpoint = IngestionCheckpoint.for_pdf(INGESTION_JOBS_FOLDER, file_path,
+                                                     settings=extraction_settings(**PDF_OPTIONS),
+                                                     model_path=LAYOUT_MODEL_PATH)
+            # Embedding của các summary khi phân cụm được dùng lại khi tạo ontology
+            embedding_store = EmbeddingStore(model_embedding)
+            clustering_tree = process_PDF_file(client, model_embedding, model_detect_layout, reader, file_path,
+                                               pdf_options=PDF_OPTIONS, checkpoint=checkpoint,
+                                               llm_executor=llm_executor,
+                                               extraction_mode=LLM_EXTRACTION_MODE,
+                                               llm_min_round=LLM_MIN_ROUND,
+                                               embedding_store=embedding_store,
+                                               k_engine=CLUSTER_K_ENGINE,
+                                               kmeans_sweep_options=KMEANS_SWEEP_OPTIONS,
+                                               tree_engine=TREE_ENGINE,
+                                               branching_factor=TREE_BRANCHING_FACTOR)
             print("process_PDF_file hoàn tất.")
 
             # 2. Xây dựng ontology ngay lập tức (tuần tự)
@@ -263,8 +375,10 @@ def upload_pdf():
             ontology_filename = f"{user_session_id}_ontology.owl"
             ontology_iri = f"http://www.semanticweb.org/{user_session_id}_MINDMAP"
             ontology_save_path = os.path.join(GENERATED_ONTOLOGIES_FOLDER, ontology_filename)
-            create_ontology(model_embedding, clustering_tree, ontology_save_path, ontology_iri)
+            create_ontology(model_embedding, clustering_tree, ontology_save_path, ontology_iri, embedding_store,
+                            embedding_sidecar=ONTOLOGY_EMBEDDING_SIDECAR)
             print(f"Ontology đã được xây dựng và lưu tại: {ontology_save_path}")
+            checkpoint.clear()
 
             # Cập nhật trạng thái trong Redis
             set_ontology_state(user_session_id, {
@@ -291,6 +405,9 @@ def upload_pdf():
             print(f"Lỗi trong quá trình xử lý PDF hoặc xây dựng ontology: {e}")
             import traceback
             traceback.print_exc()
+            # Giữ lại checkpoint để lần upload sau chạy tiếp, chỉ mở khóa job
+            if checkpoint is not None:
+                checkpoint.release()
             # Dọn dẹp file PDF tạm nếu có lỗi
             if os.path.exists(file_path):
                 os.remove(file_path)
@@ -519,6 +636,12 @@ def reset_session_route():
         "session_id": new_session_id,
         "message": "Session đã được reset và tạo mới."
     }), 200
+@app.route("/api/llm-cache-stats", methods=["GET"])
+def get_llm_cache_stats():
+    """Endpoint để xem số lần hit/miss và dung lượng của cache LLM"""
+    if llm_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **llm_cache.stats()})
 @app.route("/api/session-info", methods=["GET"])
 def get_session_info():
     """Endpoint để lấy thông tin chi tiết về session"""